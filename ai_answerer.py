@@ -1,15 +1,69 @@
 # Piazza-Chimp AI Answerer
 # Claude API integration with error handling
 
-import time
+import asyncio
+import functools
 import logging
+import threading
+import time
+import weakref
+from dataclasses import dataclass
 import anthropic
 from anthropic import RateLimitError, APIConnectionError, APIError
 
+import answer_guard
 import config
+import metrics
+import rate_limit
 
 logger = logging.getLogger(__name__)
 
+# Background event loop that runs generations for synchronous callers
+_loop = None
+_loop_lock = threading.Lock()
+
+# What each route is for, shown to the router model when the local heuristic is unsure
+_ROUTE_DESCRIPTIONS = {
+    "logistics": "course administration: deadlines, rooms, exam times, grading or submission policies",
+    "simple": "a short factual or conceptual question with a direct answer",
+    "complex": "a deep conceptual question, debugging help, or multi-step reasoning",
+}
+
+# Per event loop: one long-lived AsyncAnthropic client per API key (sharing
+# its HTTP connection pool) and the semaphore capping in-flight requests
+_loop_state = weakref.WeakKeyDictionary()
+
+
+@dataclass
+class AnswerResult:
+    """
+    A generated answer plus what it cost.
+
+    guard names the answer guard that stopped generation, if any: the answer
+    was either trimmed to the word budget (truncated) or rejected by a policy
+    pattern, in which case text is empty.
+    """
+    text: str
+    model: str
+    input_tokens: int = 0
+    output_tokens: int = 0
+    cache_read_input_tokens: int = 0
+    cache_creation_input_tokens: int = 0
+    ttft_sec: float | None = None
+    latency_sec: float | None = None
+    guard: str | None = None
+    truncated: bool = False
+    route: str | None = None
+
+    @property
+    def rejected(self) -> bool:
+        return self.guard is not None and not self.truncated
+
+    @property
+    def total_tokens(self) -> int:
+        return (self.input_tokens + self.cache_read_input_tokens
+                + self.cache_creation_input_tokens + self.output_tokens)
+
 
 def get_client(api_key: str) -> anthropic.Anthropic:
     """Create and return an Anthropic client with retries configured."""
@@ -20,29 +74,49 @@ def get_client(api_key: str) -> anthropic.Anthropic:
     )
 
 
-def generate_answer(
-    subject: str,
-    content: str,
-    course_name: str,
-    api_key: str,
-    context: str = "",
-) -> str | None:
-    """
-    Generate an answer using Claude API.
+def get_async_client(api_key: str) -> anthropic.AsyncAnthropic:
+    """Return the shared async client for the running event loop, creating it on first use."""
+    state = _get_loop_state()
+    client = state["clients"].get(api_key)
+    if client is None:
+        client = anthropic.AsyncAnthropic(
+            api_key=api_key,
+            max_retries=3,
+            timeout=30.0,
+        )
+        state["clients"][api_key] = client
+    return client
 
-    Args:
-        subject: Post subject/title
-        content: Plain text post content
-        course_name: Name of the course (for system prompt)
-        api_key: Anthropic API key
-        context: Optional RAG context (course materials and past Q&As)
 
-    Returns:
-        Generated answer text, or None if an error occurred
-    """
-    client = get_client(api_key)
+def _get_loop_state() -> dict:
+    """Return the client cache and concurrency cap for the running event loop."""
+    loop = asyncio.get_running_loop()
+    state = _loop_state.get(loop)
+    if state is None:
+        state = {
+            "clients": {},
+            "semaphore": asyncio.Semaphore(config.ANTHROPIC_MAX_CONCURRENCY),
+        }
+        _loop_state[loop] = state
+    return state
+
+
+def _get_loop() -> asyncio.AbstractEventLoop:
+    """Start (once) and return the background event loop used by generate_answer."""
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            loop = asyncio.new_event_loop()
+            thread = threading.Thread(target=loop.run_forever, name="anthropic-loop", daemon=True)
+            thread.start()
+            _loop = loop
+    return _loop
 
-    system_prompt = f"""
+
+@functools.lru_cache(maxsize=None)
+def _static_system_prompt(course_name: str) -> str:
+    """The instruction part of the system prompt, identical for every question in a course."""
+    return f"""
     You are a knowledgeable and thoughtful classmate in {course_name}.
 
     Your goal is to help others understand concepts by explaining ideas clearly, not by simply giving answers.
@@ -70,9 +144,9 @@ def generate_answer(
     """
 
 
-    # Inject context if available
-    if context:
-        system_prompt += f"""
+def _context_prompt(context: str) -> str:
+    """The per-question part of the system prompt carrying the RAG context."""
+    return f"""
 
 [RELEVANT CONTEXT]
 {context}
@@ -80,36 +154,462 @@ def generate_answer(
 
 Use the above context if relevant to answering the question. If the context doesn't help, use general knowledge."""
 
-    user_prompt = f"Subject: {subject}\n\nQuestion: {content}"
 
-    try:
-        logger.info(f"Generating answer for: {subject[:50]}...")
-        message = client.messages.create(
-            model=config.MODEL,
-            max_tokens=config.ANTHROPIC_MAX_TOKENS,
-            system=system_prompt,
-            messages=[
-                {"role": "user", "content": user_prompt}
-            ],
-        )
-        answer = message.content[0].text
-        logger.info("Successfully generated answer")
-        return answer
+def build_system_prompt(course_name: str, context: str = "") -> str:
+    """Build the system prompt, injecting RAG context when available."""
+    system_prompt = _static_system_prompt(course_name)
 
-    except RateLimitError as e:
-        logger.warning(f"Rate limited by Claude API: {e}")
-        logger.info("Sleeping for 60 seconds before retry...")
-        time.sleep(60)
-        return None
+    # Inject context if available
+    if context:
+        system_prompt += _context_prompt(context)
+
+    return system_prompt
+
+
+def build_system_blocks(course_name: str, context: str = "") -> list[dict]:
+    """
+    Build the system prompt as content blocks for prompt caching.
+
+    The static instructions come first and carry a cache breakpoint, so
+    Claude can reuse them across requests; the RAG context, which changes
+    with every question, follows uncached.
+    """
+    blocks = [{
+        "type": "text",
+        "text": _static_system_prompt(course_name),
+        "cache_control": {"type": "ephemeral"},
+    }]
+    if context:
+        blocks.append({"type": "text", "text": _context_prompt(context)})
+    return blocks
+
+
+def build_request(
+    subject: str,
+    content: str,
+    course_name: str,
+    context: str = "",
+    model: str | None = None,
+    max_tokens: int | None = None,
+) -> dict:
+    """Build the Messages API parameters for one question (shared by live and batch generation)."""
+    return {
+        "model": model or config.MODEL,
+        "max_tokens": max_tokens or config.ANTHROPIC_MAX_TOKENS,
+        "system": build_system_blocks(course_name, context),
+        "messages": [
+            {"role": "user", "content": f"Subject: {subject}\n\nQuestion: {content}"}
+        ],
+    }
+
+
+def _result_from_message(message, text: str | None = None) -> AnswerResult:
+    """Convert a Messages API response into an AnswerResult (optionally with edited text)."""
+    usage = message.usage
+    return AnswerResult(
+        text=message.content[0].text if text is None else text,
+        model=message.model,
+        input_tokens=usage.input_tokens,
+        output_tokens=usage.output_tokens,
+        cache_read_input_tokens=getattr(usage, "cache_read_input_tokens", None) or 0,
+        cache_creation_input_tokens=getattr(usage, "cache_creation_input_tokens", None) or 0,
+    )
 
-    except APIConnectionError as e:
-        logger.error(f"Connection error with Claude API: {e}")
-        return None
 
-    except APIError as e:
-        logger.error(f"Claude API error: {e}")
+def templated_answer(result: dict, kind: str) -> str:
+    """
+    Answer by quoting a retrieved past Q&A or material excerpt, without calling Claude.
+
+    Args:
+        result: Retrieval result dict (keys: id, text, metadata, distance)
+        kind: "piazza" for a piazza_history hit, "materials" for a course material chunk
+    """
+    text = result["text"]
+    metadata = result["metadata"]
+    if kind == "piazza":
+        post_nr = metadata.get("post_nr", "?")
+        # Piazza history documents are "Q: ...\n\nA: ..."; quote just the answer
+        _, separator, answer = text.partition("\n\nA: ")
+        excerpt = answer_guard.trim_to_words(answer if separator else text, config.FAST_PATH_QUOTE_WORDS)
+        return f'This was answered before in @{post_nr}:\n\n"{excerpt}"\n\nSee @{post_nr} for the full thread.'
+    source = metadata.get("source", "the course materials")
+    excerpt = answer_guard.trim_to_words(text, config.FAST_PATH_QUOTE_WORDS)
+    return f'The course materials cover this ({source}):\n\n"{excerpt}"'
+
+
+def route_label(classification) -> str | None:
+    """
+    Map a heuristic classification (rag.classifier.Classification) to a route.
+
+    Returns None when the classification is too ambiguous to act on.
+    """
+    if classification.confidence < config.ROUTE_MIN_CONFIDENCE:
         return None
+    if classification.category == "logistics":
+        return "logistics"
+    if classification.covered and not classification.long:
+        return "simple"
+    return "complex"
+
+
+async def aroute(subject: str, content: str, api_key: str, classification) -> str:
+    """
+    Pick the route (a key of config.MODEL_ROUTES) for a question.
+
+    The local heuristic decides when it is confident; otherwise the router
+    model is asked, and config.ROUTE_DEFAULT is used if that fails too.
+    """
+    label = route_label(classification)
+    if label is None and config.ROUTE_LLM_FALLBACK:
+        metrics.increment("routes.llm_fallbacks")
+        label = await _aclassify_with_model(subject, content, api_key)
+    if label not in config.MODEL_ROUTES:
+        label = config.ROUTE_DEFAULT
+    metrics.increment(f"routes.{label}")
+    return label
 
+
+async def _aclassify_with_model(subject: str, content: str, api_key: str) -> str | None:
+    """
+    Ask the router model for a route label; None if the call fails or the reply is not a label.
+
+    The call shares the answer requests' rate limit and backoff, and its tokens
+    are counted in the anthropic.* metrics (and separately in routes.router_*).
+    A rate-limited router call is not retried: the default route is cheaper
+    than waiting.
+    """
+    labels = [label for label in _ROUTE_DESCRIPTIONS if label in config.MODEL_ROUTES]
+    system_prompt = (
+        "Classify the student question into exactly one category and reply with the category name only.\n"
+        + "\n".join(f"- {label}: {_ROUTE_DESCRIPTIONS[label]}" for label in labels)
+    )
+    client = get_async_client(api_key)
+    bucket = rate_limit.get_bucket("anthropic")
+    backoff = rate_limit.get_backoff("anthropic")
+    try:
+        async with _get_loop_state()["semaphore"]:
+            await bucket.acquire_async()
+            response = await client.messages.with_raw_response.create(
+                model=config.ROUTER_MODEL,
+                max_tokens=5,
+                system=system_prompt,
+                messages=[
+                    {"role": "user", "content": f"Subject: {subject}\n\nQuestion: {content}"}
+                ],
+            )
+        _observe_rate_limit_headers(response.headers)
+        backoff.success()
+        message = response.parse()
+
+        usage = message.usage
+        metrics.increment("anthropic.requests")
+        metrics.increment("anthropic.input_tokens", usage.input_tokens)
+        metrics.increment("anthropic.output_tokens", usage.output_tokens)
+        metrics.increment("routes.router_input_tokens", usage.input_tokens)
+        metrics.increment("routes.router_output_tokens", usage.output_tokens)
+
+        label = message.content[0].text.strip().lower().strip(".")
+    except RateLimitError as e:
+        # Hold back every in-flight request, as agenerate does
+        delay = rate_limit.retry_delay_from_headers(e.response.headers) or backoff.failure()
+        bucket.pause(delay)
+        logger.warning(f"Router model call rate limited, pausing requests for {delay:.0f}s")
+        return None
     except Exception as e:
-        logger.error(f"Unexpected error generating answer: {e}")
+        logger.warning(f"Router model call failed: {e}")
         return None
+    return label if label in labels else None
+
+
+async def agenerate(
+    subject: str,
+    content: str,
+    course_name: str,
+    api_key: str,
+    context: str = "",
+    classification=None,
+) -> AnswerResult | None:
+    """
+    Generate an answer using the async Claude API.
+
+    Requests share one client per event loop and at most
+    config.ANTHROPIC_MAX_CONCURRENCY of them are in flight at once.
+
+    Args:
+        subject: Post subject/title
+        content: Plain text post content
+        course_name: Name of the course (for system prompt)
+        api_key: Anthropic API key
+        context: Optional RAG context (course materials and past Q&As)
+        classification: Optional rag.classifier.Classification; when given the
+            question is routed to the model and token budget of its route in
+            config.MODEL_ROUTES, otherwise config.MODEL is used
+
+    With config.ANTHROPIC_STREAMING the answer is consumed as it streams in
+    and the answer guards run on the fly: going over config.ANSWER_MAX_WORDS
+    stops generation and trims the answer, and matching one of
+    config.ANSWER_POLICY_PATTERNS stops it and rejects the answer.
+
+    Returns:
+        AnswerResult with the answer text, token usage and timings, or None if an error occurred
+    """
+    client = get_async_client(api_key)
+
+    route = None
+    model, max_tokens = config.MODEL, config.ANTHROPIC_MAX_TOKENS
+    if classification is not None:
+        route = await aroute(subject, content, api_key, classification)
+        model, max_tokens = config.MODEL_ROUTES[route]
+    request = build_request(subject, content, course_name, context, model=model, max_tokens=max_tokens)
+
+    bucket = rate_limit.get_bucket("anthropic")
+    backoff = rate_limit.get_backoff("anthropic")
+    attempt = 0
+
+    while True:
+        try:
+            async with _get_loop_state()["semaphore"]:
+                await bucket.acquire_async()
+                logger.info(f"Generating answer for: {subject[:50]} ({route or 'default'} route, {model})...")
+                started = time.monotonic()
+                if config.ANTHROPIC_STREAMING:
+                    message, headers, guard, ttft = await _stream_message(client, request, started)
+                else:
+                    response = await client.messages.with_raw_response.create(**request)
+                    message, headers, ttft = response.parse(), response.headers, None
+                    guard = answer_guard.check_answer(
+                        message.content[0].text, config.ANSWER_MAX_WORDS, config.ANSWER_POLICY_PATTERNS
+                    )
+                latency = time.monotonic() - started
+            _observe_rate_limit_headers(headers)
+            backoff.success()
+
+            result = _result_from_message(message, text="" if guard.rejected else guard.text)
+            result.ttft_sec = ttft
+            result.latency_sec = latency
+            result.guard = guard.tripped
+            result.truncated = guard.truncated
+            result.route = route
+
+            metrics.increment("anthropic.requests")
+            metrics.increment("anthropic.input_tokens", result.input_tokens)
+            metrics.increment("anthropic.output_tokens", result.output_tokens)
+            metrics.increment("anthropic.cache_read_input_tokens", result.cache_read_input_tokens)
+            metrics.increment("anthropic.cache_creation_input_tokens", result.cache_creation_input_tokens)
+            timing = f"first token {ttft:.2f}s, " if ttft is not None else ""
+            if result.rejected:
+                metrics.increment("answers.rejected")
+                logger.warning(f"Answer stopped by the {result.guard} guard after {latency:.2f}s")
+                return result
+            if result.truncated:
+                metrics.increment("answers.truncated")
+                logger.info(f"Answer trimmed to {config.ANSWER_MAX_WORDS} words")
+            logger.info(
+                f"Successfully generated answer ({timing}total {latency:.2f}s; {result.input_tokens} input, "
+                f"{result.cache_read_input_tokens} cache read, {result.cache_creation_input_tokens} cache write, "
+                f"{result.output_tokens} output tokens)"
+            )
+            return result
+
+        except RateLimitError as e:
+            # Hold back every in-flight generation, not just this one, then retry
+            delay = rate_limit.retry_delay_from_headers(e.response.headers) or backoff.failure()
+            bucket.pause(delay)
+            if attempt >= config.ANTHROPIC_RATE_LIMIT_RETRIES:
+                logger.warning(f"Rate limited by Claude API, giving up after {attempt} retries: {e}")
+                return None
+            attempt += 1
+            logger.warning(f"Rate limited by Claude API, retry {attempt} in {delay:.0f}s")
+
+        except APIConnectionError as e:
+            logger.error(f"Connection error with Claude API: {e}")
+            return None
+
+        except APIError as e:
+            logger.error(f"Claude API error: {e}")
+            return None
+
+        except Exception as e:
+            logger.error(f"Unexpected error generating answer: {e}")
+            return None
+
+
+async def _stream_message(client, request: dict, started: float):
+    """
+    Stream a response through the answer guards, closing the stream as soon as one trips.
+
+    Returns:
+        (message snapshot, response headers, AnswerGuard, seconds to first token or None)
+    """
+    guard = answer_guard.AnswerGuard(config.ANSWER_MAX_WORDS, config.ANSWER_POLICY_PATTERNS)
+    ttft = None
+    async with client.messages.stream(**request) as stream:
+        headers = stream.response.headers
+        async for text in stream.text_stream:
+            if ttft is None:
+                ttft = time.monotonic() - started
+            if guard.feed(text):
+                break
+        message = stream.current_message_snapshot
+    return message, headers, guard, ttft
+
+
+def _observe_rate_limit_headers(headers) -> None:
+    """Track the real Claude rate limit and pause early when a limit is exhausted."""
+    bucket = rate_limit.get_bucket("anthropic")
+    rate = rate_limit.requests_per_second_from_headers(headers)
+    if rate:
+        bucket.set_rate(rate)
+    delay = rate_limit.retry_delay_from_headers(headers)
+    if delay:
+        logger.info(f"Claude rate limit exhausted, pausing requests for {delay:.0f}s")
+        bucket.pause(delay)
+
+
+async def agenerate_answer(
+    subject: str,
+    content: str,
+    course_name: str,
+    api_key: str,
+    context: str = "",
+) -> str | None:
+    """
+    Generate an answer using the async Claude API.
+
+    Same as agenerate, but returns only the answer text.
+
+    Returns:
+        Generated answer text, or None if an error occurred
+    """
+    result = await agenerate(subject, content, course_name, api_key, context)
+    return result.text if result and not result.rejected else None
+
+
+def generate(
+    subject: str,
+    content: str,
+    course_name: str,
+    api_key: str,
+    context: str = "",
+    classification=None,
+) -> AnswerResult | None:
+    """
+    Generate an answer using Claude API.
+
+    Blocking wrapper around agenerate; the request runs on a shared
+    background event loop so concurrent callers reuse one client.
+
+    Args:
+        subject: Post subject/title
+        content: Plain text post content
+        course_name: Name of the course (for system prompt)
+        api_key: Anthropic API key
+        context: Optional RAG context (course materials and past Q&As)
+        classification: Optional rag.classifier.Classification used to route the question
+
+    Returns:
+        AnswerResult with the answer text and token usage, or None if an error occurred
+    """
+    future = asyncio.run_coroutine_threadsafe(
+        agenerate(subject, content, course_name, api_key, context, classification),
+        _get_loop(),
+    )
+    return future.result()
+
+
+def generate_answer(
+    subject: str,
+    content: str,
+    course_name: str,
+    api_key: str,
+    context: str = "",
+) -> str | None:
+    """
+    Generate an answer using Claude API.
+
+    Blocking wrapper around agenerate_answer; the request runs on a shared
+    background event loop so concurrent callers reuse one client.
+
+    Args:
+        subject: Post subject/title
+        content: Plain text post content
+        course_name: Name of the course (for system prompt)
+        api_key: Anthropic API key
+        context: Optional RAG context (course materials and past Q&As)
+
+    Returns:
+        Generated answer text, or None if an error occurred
+    """
+    result = generate(subject, content, course_name, api_key, context)
+    return result.text if result and not result.rejected else None
+
+
+def submit_batch(requests: list[tuple[str, dict]], api_key: str) -> str:
+    """
+    Submit questions to the Message Batches API.
+
+    Batches run asynchronously at a discount and do not count against the
+    live rate limit, so they suit bulk work such as a backlog of old posts.
+
+    Args:
+        requests: (custom_id, params) pairs, params as built by build_request
+        api_key: Anthropic API key
+
+    Returns:
+        ID of the created batch
+    """
+    client = get_client(api_key)
+    batch = client.messages.batches.create(
+        requests=[{"custom_id": custom_id, "params": params} for custom_id, params in requests]
+    )
+    logger.info(f"Submitted batch {batch.id} with {len(requests)} request(s)")
+    return batch.id
+
+
+def wait_for_batch(batch_id: str, api_key: str, poll_interval: float):
+    """
+    Block until a batch has finished processing.
+
+    Args:
+        batch_id: ID returned by submit_batch
+        api_key: Anthropic API key
+        poll_interval: Seconds between status checks
+
+    Returns:
+        The ended batch object
+    """
+    client = get_client(api_key)
+    while True:
+        batch = client.messages.batches.retrieve(batch_id)
+        if batch.processing_status == "ended":
+            logger.info(f"Batch {batch_id} ended")
+            return batch
+        counts = batch.request_counts
+        logger.info(
+            f"Batch {batch_id} {batch.processing_status}: {counts.processing} processing, "
+            f"{counts.succeeded} succeeded, {counts.errored} errored"
+        )
+        time.sleep(poll_interval)
+
+
+def iter_batch_results(batch_id: str, api_key: str):
+    """
+    Yield the outcome of every request in an ended batch.
+
+    Args:
+        batch_id: ID of an ended batch
+        api_key: Anthropic API key
+
+    Yields:
+        (custom_id, AnswerResult or None, error message or None) tuples
+    """
+    client = get_client(api_key)
+    for entry in client.messages.batches.results(batch_id):
+        outcome = entry.result
+        if outcome.type == "succeeded":
+            yield entry.custom_id, _result_from_message(outcome.message), None
+        elif outcome.type == "errored":
+            yield entry.custom_id, None, f"batch request errored: {outcome.error}"
+        else:
+            # canceled or expired
+            yield entry.custom_id, None, f"batch request {outcome.type}"
@@ -0,0 +1,80 @@
+# Piazza-Chimp Answer Guards
+# Word budget and policy checks applied to answers as they are generated
+
+import re
+
+# Characters of already checked text re-scanned with each new chunk, so a
+# policy phrase split across two streamed chunks is still caught
+_POLICY_OVERLAP = 200
+
+
+class AnswerGuard:
+    """
+    Incremental checks over an answer's text as it streams in.
+
+    feed() takes each new piece of text and returns True once generation
+    should stop: either the answer went past the word budget (it is trimmed
+    and still usable) or it matched a policy pattern (it is rejected).
+    """
+
+    def __init__(self, max_words: int, policy_patterns: dict[str, str]):
+        """
+        Initialize the guard.
+
+        Args:
+            max_words: Word budget; longer answers are trimmed to it
+            policy_patterns: {name: regex} of content that gets an answer rejected
+        """
+        self.max_words = max_words
+        self._patterns = [(name, re.compile(pattern)) for name, pattern in policy_patterns.items()]
+        self._checked = 0
+        self.text = ""
+        self.tripped = None
+        self.truncated = False
+
+    @property
+    def rejected(self) -> bool:
+        """True if a policy pattern matched."""
+        return self.tripped is not None and not self.truncated
+
+    def feed(self, delta: str) -> bool:
+        """Add newly generated text; return True if generation should stop."""
+        if self.tripped:
+            return True
+        self.text += delta
+
+        window = self.text[max(0, self._checked - _POLICY_OVERLAP):]
+        self._checked = len(self.text)
+        for name, pattern in self._patterns:
+            if pattern.search(window):
+                self.tripped = name
+                return True
+
+        if len(self.text.split()) > self.max_words:
+            self.text = trim_to_words(self.text, self.max_words)
+            self.tripped = "word_budget"
+            self.truncated = True
+            return True
+
+        return False
+
+
+def trim_to_words(text: str, max_words: int) -> str:
+    """Cut text to at most max_words words, preferring to end on a full sentence."""
+    words = list(re.finditer(r"\S+", text))
+    if len(words) <= max_words:
+        return text
+    cut = text[:words[max_words - 1].end()]
+
+    # Back up to the last sentence end, unless that would drop most of the answer
+    sentence_end = max(cut.rfind(". "), cut.rfind("! "), cut.rfind("? "), cut.rfind(".\n"))
+    if sentence_end > len(cut) // 2:
+        cut = cut[:sentence_end + 1]
+    return cut.rstrip()
+
+
+def check_answer(text: str, max_words: int, policy_patterns: dict[str, str]) -> AnswerGuard:
+    """Run the guards over a complete answer (for answers that were not streamed)."""
+    guard = AnswerGuard(max_words, policy_patterns)
+    guard.feed(text)
+    return guard
@@ -0,0 +1,274 @@
+#!/usr/bin/env python3
+# Draft answers for pending posts in bulk through the Message Batches API
+# Usage: python batch_answers.py [--limit N] [--workers N] [--poll SEC]
+#
+# Drafts are written to the post-state DB; the running bot posts them.
+
+import argparse
+import logging
+import sys
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from dotenv import load_dotenv
+
+import ai_answerer
+import answer_guard
+import config
+import db
+import piazza_client
+from rag.retriever import Retriever
+
+# Load environment variables
+load_dotenv()
+
+# Setup logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+# sync_state key holding the ID of a submitted batch whose results are not yet stored
+BATCH_ID_KEY = "answer_batch_id"
+
+
+def collect_questions(network, conn, post_states: dict, limit: int, workers: int) -> list[dict]:
+    """
+    Find unread posts that still need an answer and extract their questions.
+
+    Posts that turn out not to need an answer are marked skipped, as the bot
+    would. Returns one dict per question with keys: post_id, post_nr,
+    subject, content.
+    """
+    now = datetime.utcnow()
+    items = []
+    for item in piazza_client.iter_unread_posts(network):
+        if db.should_batch(post_states.get(item.get("id")), now, config.POST_MAX_ATTEMPTS):
+            items.append(item)
+            if len(items) >= limit:
+                logger.warning(f"Stopping at {limit} post(s); run again for the rest")
+                break
+    logger.info(f"{len(items)} post(s) need an answer")
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="piazza-fetch") as executor:
+        full_posts = list(executor.map(lambda item: piazza_client.get_full_post(network, item.get("id")), items))
+
+    questions = []
+    skipped = []
+    for item, full_post in zip(items, full_posts):
+        post_id = item.get("id")
+        post_nr = item.get("nr", 0)
+        if not full_post:
+            # Left as is; the bot or the next batch run will retry the fetch
+            continue
+
+        history = full_post.get("history", [])
+        content = piazza_client.strip_html(history[0].get("content", "")) if history else ""
+        if not piazza_client.should_answer(full_post) or not content:
+            skipped.append({
+                "post_id": post_id,
+                "post_nr": post_nr,
+                "status": db.STATUS_SKIPPED,
+                "attempts": 0,
+                "updated_at": now.isoformat(),
+            })
+            continue
+
+        questions.append({
+            "post_id": post_id,
+            "post_nr": post_nr,
+            "subject": history[0].get("subject", "(no subject)"),
+            "content": content,
+        })
+
+    db.save_post_states(conn, skipped)
+    logger.info(f"{len(questions)} question(s) to draft, {len(skipped)} post(s) skipped")
+    return questions
+
+
+def submit(conn, questions: list[dict], api_key: str, course_name: str) -> str:
+    """Retrieve context for the questions, submit them as one batch and mark them batched."""
+    contexts = [""] * len(questions)
+    try:
+        retriever = Retriever(
+            config.CHROMA_DB_PATH,
+            config.EMBEDDING_MODEL,
+            max_distance=config.RAG_MAX_DISTANCE,
+            token_budget=config.RAG_CONTEXT_TOKEN_BUDGET,
+            collections=config.RAG_COLLECTIONS,
+            fusion_strategy=config.RAG_FUSION,
+            rrf_k=config.RAG_RRF_K,
+        )
+        retrievals = retriever.query_many(
+            [f"{q['subject']} {q['content']}" for q in questions], top_k=config.RAG_TOP_K
+        )
+        contexts = [retrieval.text for retrieval in retrievals]
+    except Exception as e:
+        logger.warning(f"Error retrieving RAG context, drafting without it: {e}")
+
+    requests = [
+        (q["post_id"], ai_answerer.build_request(q["subject"], q["content"], course_name, context))
+        for q, context in zip(questions, contexts)
+    ]
+    batch_id = ai_answerer.submit_batch(requests, api_key)
+    db.set_sync_state(conn, BATCH_ID_KEY, batch_id)
+
+    # Keep the bot from answering these live while the batch runs; if the batch
+    # is lost, they become due again once it would have expired
+    now = datetime.utcnow()
+    expires_at = (now + timedelta(seconds=config.BATCH_EXPIRY_SEC)).isoformat()
+    db.save_post_states(conn, [{
+        "post_id": q["post_id"],
+        "post_nr": q["post_nr"],
+        "status": db.STATUS_BATCHED,
+        "attempts": 0,
+        "next_retry_at": expires_at,
+        "updated_at": now.isoformat(),
+    } for q in questions])
+    return batch_id
+
+
+def store_results(conn, batch_id: str, api_key: str) -> dict:
+    """Write each batch result into the post-state DB as a draft, a failure or a rejection."""
+    post_states = db.load_post_states(conn)
+    counts = {"drafted": 0, "failed": 0, "rejected": 0, "input_tokens": 0, "output_tokens": 0}
+    now = datetime.utcnow()
+    states = []
+
+    for post_id, result, error in ai_answerer.iter_batch_results(batch_id, api_key):
+        # Batch answers can't be stopped early, so the answer guards run on the result
+        rejected = False
+        if result is not None:
+            guard = answer_guard.check_answer(result.text, config.ANSWER_MAX_WORDS, config.ANSWER_POLICY_PATTERNS)
+            if guard.rejected:
+                rejected, error = True, f"answer rejected by {guard.tripped} guard"
+            else:
+                result.text = guard.text
+
+        previous = post_states.get(post_id) or {}
+        # Don't overwrite a post the bot has already handled some other way
+        if previous.get("status") in db.FINAL_STATUSES:
+            continue
+        state = {
+            "post_id": post_id,
+            "post_nr": previous.get("post_nr", 0),
+            "attempts": previous.get("attempts", 0),
+            "updated_at": now.isoformat(),
+        }
+        if result is not None:
+            counts["input_tokens"] += result.input_tokens
+            counts["output_tokens"] += result.output_tokens
+        if rejected:
+            # As in the bot: a new attempt would most likely be rejected again
+            state.update(status=db.STATUS_SKIPPED, last_error=error)
+            counts["rejected"] += 1
+            logger.warning(f"Draft for post {post_id} {error}, skipping the post")
+        elif result is not None:
+            state.update(status=db.STATUS_DRAFTED, draft=result.text)
+            counts["drafted"] += 1
+        else:
+            attempts = state["attempts"] + 1
+            delay = min(config.POST_RETRY_MAX_SEC, config.POST_RETRY_BASE_SEC * 2 ** (attempts - 1))
+            state.update(
+                status=db.STATUS_FAILED,
+                attempts=attempts,
+                next_retry_at=(now + timedelta(seconds=delay)).isoformat(),
+                last_error=error,
+            )
+            counts["failed"] += 1
+            logger.warning(f"No draft for post {post_id}: {error}")
+        states.append(state)
+
+    db.save_post_states(conn, states)
+    db.set_sync_state(conn, BATCH_ID_KEY, "")
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Draft answers for pending Piazza posts through the Message Batches API"
+    )
+    parser.add_argument(
+        "--limit",
+        type=int,
+        default=config.BATCH_MAX_REQUESTS,
+        help=f"Maximum posts to submit in one batch (default: {config.BATCH_MAX_REQUESTS})"
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=config.PIAZZA_INGEST_WORKERS,
+        help=f"Concurrent full-post fetches (default: {config.PIAZZA_INGEST_WORKERS})"
+    )
+    parser.add_argument(
+        "--poll",
+        type=float,
+        default=config.BATCH_POLL_SEC,
+        help=f"Seconds between batch status checks (default: {config.BATCH_POLL_SEC})"
+    )
+    args = parser.parse_args()
+
+    logger.info("=" * 60)
+    logger.info("Drafting Answers in Batch Mode")
+    logger.info("=" * 60)
+
+    api_key = os.getenv("ANTHROPIC_API_KEY")
+    if not api_key:
+        logger.error("Missing ANTHROPIC_API_KEY in .env")
+        sys.exit(1)
+
+    conn = db.init_db(config.DB_PATH)
+
+    # A batch submitted by an earlier, interrupted run is collected instead of resubmitting
+    batch_id = db.get_sync_state(conn, BATCH_ID_KEY)
+    if batch_id:
+        logger.info(f"Resuming batch {batch_id}")
+    else:
+        email = os.getenv("PIAZZA_EMAIL")
+        password = os.getenv("PIAZZA_PASSWORD")
+        network_id = os.getenv("PIAZZA_NETWORK")
+        if not all([email, password, network_id]):
+            logger.error("Missing Piazza credentials in .env")
+            sys.exit(1)
+
+        try:
+            network = piazza_client.login(email=email, password=password, network_id=network_id)
+        except Exception as e:
+            logger.error(f"Failed to login to Piazza: {e}")
+            sys.exit(1)
+
+        questions = collect_questions(network, conn, db.load_post_states(conn), args.limit, args.workers)
+        if not questions:
+            logger.info("Nothing to draft")
+            conn.close()
+            return
+
+        try:
+            batch_id = submit(conn, questions, api_key, os.getenv("COURSE_NAME"))
+        except Exception as e:
+            logger.error(f"Failed to submit batch: {e}")
+            conn.close()
+            sys.exit(1)
+
+    try:
+        ai_answerer.wait_for_batch(batch_id, api_key, args.poll)
+        counts = store_results(conn, batch_id, api_key)
+    except KeyboardInterrupt:
+        logger.info(f"Interrupted; run again to collect batch {batch_id}")
+        conn.close()
+        sys.exit(0)
+
+    conn.close()
+
+    logger.info("=" * 60)
+    logger.info(
+        f"Summary: {counts['drafted']} draft(s) stored for the bot to post, {counts['failed']} failed, "
+        f"{counts['rejected']} rejected by the answer guards. "
+        f"Tokens: {counts['input_tokens']} input, {counts['output_tokens']} output"
+    )
+    logger.info("=" * 60)
+
+
+if __name__ == "__main__":
+    main()
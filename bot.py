@@ -6,12 +6,20 @@ import time
 import logging
 import sys
 import os
+import threading
+from datetime import datetime, timedelta
 from dotenv import load_dotenv
 
 import config
 import db
 import piazza_client
 import ai_answerer
+import metrics
+import pipeline
+from poll_scheduler import PollScheduler
+from rag import embedder
+from rag.answer_cache import AnswerCache, adapt_answer
+from rag.classifier import QuestionClassifier
 from rag.retriever import Retriever
 
 # Load environment variables from .env file
@@ -24,6 +32,260 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# sync_state key holding the newest feed marker the bot has walked past
+FEED_CURSOR_KEY = "bot_feed_cursor"
+
+
+def build_pipeline(network, retriever, answer_cache, classifier, snapshot, set_status) -> pipeline.Pipeline:
+    """
+    Build the fetch -> retrieve -> generate -> post pipeline.
+
+    Each job is a dict that starts as {"post_id", "post_nr", "marker"} and is
+    filled in by the stages as it moves through. A stage returns None to drop
+    the job. set_status(job, status, error=None) records every state transition.
+    Full posts are cached in the feed snapshot, so retrying an unchanged post
+    does not fetch it again. A question close enough to one the bot already
+    answered reuses that answer from answer_cache instead of calling Claude,
+    and a job carrying a "draft" from batch mode posts that draft. With a
+    classifier, each question is routed to a model by its classification,
+    and a logistics question with a very close RAG hit is answered by
+    quoting that hit.
+    """
+
+    def fetch(job):
+        post_id = job["post_id"]
+        post_nr = job["post_nr"]
+
+        full_post = snapshot.get_post(post_id, job["marker"])
+        if full_post is None:
+            full_post = piazza_client.get_full_post(network, post_id)
+            if not full_post:
+                logger.warning(f"Could not fetch full post {post_id}")
+                set_status(job, db.STATUS_FAILED, "could not fetch post")
+                return None
+            snapshot.store_post(post_id, job["marker"], full_post)
+        job["full_post"] = full_post
+
+        # Check if we should answer
+        if not piazza_client.should_answer(full_post):
+            logger.info(f"Post #{post_nr} does not meet criteria for answering, marking as skipped")
+            set_status(job, db.STATUS_SKIPPED)
+            return None
+
+        # Extract question content
+        history = full_post.get("history", [])
+        if not history:
+            logger.warning(f"Post #{post_nr} has no history, skipping")
+            set_status(job, db.STATUS_SKIPPED)
+            return None
+
+        first_version = history[0]
+        job["subject"] = first_version.get("subject", "(no subject)")
+        job["content"] = piazza_client.strip_html(first_version.get("content", ""))
+
+        if not job["content"]:
+            logger.warning(f"Post #{post_nr} has no content, skipping")
+            set_status(job, db.STATUS_SKIPPED)
+            return None
+
+        return job
+
+    def retrieve(all_jobs):
+        # Batched: every job waiting in the queue shares one embedding pass,
+        # used for both the answer cache lookup and the RAG search
+        for job in all_jobs:
+            job["context"] = ""
+        # Batch drafts were generated with their context already
+        jobs = [job for job in all_jobs if "draft" not in job]
+        if not jobs or (not retriever and not answer_cache and not classifier):
+            return all_jobs
+
+        query_texts = [f"{job['subject']} {job['content']}" for job in jobs]
+        try:
+            embeddings = embedder.embed(query_texts, model_name=config.EMBEDDING_MODEL)
+        except Exception as e:
+            logger.warning(f"Error embedding questions: {e}")
+            return all_jobs
+        for job, embedding in zip(jobs, embeddings):
+            job["embedding"] = embedding
+
+        misses = jobs
+        if answer_cache:
+            try:
+                hits = answer_cache.lookup_many(embeddings)
+            except Exception as e:
+                logger.warning(f"Error looking up answer cache: {e}")
+                hits = [None] * len(jobs)
+            metrics.increment("answer_cache.lookups", len(jobs))
+            misses = []
+            for job, hit in zip(jobs, hits):
+                if hit and hit["post_id"] != job["post_id"]:
+                    job["cache_hit"] = hit
+                    metrics.increment("answer_cache.hits")
+                    metrics.increment("answer_cache.tokens_saved", hit["tokens"])
+                    logger.info(
+                        f"Post #{job['post_nr']} matches answered post @{hit['post_nr']} "
+                        f"(distance {hit['distance']:.3f})"
+                    )
+                else:
+                    misses.append(job)
+
+        rag_distances = [[] for _ in misses]
+        searches = [{} for _ in misses]
+        if retriever and misses:
+            try:
+                searches = retriever.search_many(
+                    [f"{job['subject']} {job['content']}" for job in misses],
+                    top_k=config.RAG_TOP_K,
+                    embeddings=[job["embedding"] for job in misses],
+                )
+                for index, (job, hits) in enumerate(zip(misses, searches)):
+                    # A question that already has a student answer is in piazza_history
+                    # itself; it must not be quoted back or used as its own context
+                    for name, results in hits.items():
+                        hits[name] = [result for result in results if result["id"] != job["post_id"]]
+                    job["context"] = retriever.build_context(hits).text
+                    rag_distances[index] = [result["distance"] for results in hits.values() for result in results]
+                logger.info(f"Retrieved context from RAG collections for {len(misses)} post(s)")
+            except Exception as e:
+                logger.warning(f"Error retrieving RAG context: {e}")
+
+        if classifier and misses:
+            try:
+                classifications = classifier.classify_many(
+                    [job["content"] for job in misses], [job["embedding"] for job in misses], rag_distances
+                )
+                for job, classification in zip(misses, classifications):
+                    job["classification"] = classification
+            except Exception as e:
+                logger.warning(f"Error classifying questions: {e}")
+
+        for job, hits in zip(misses, searches):
+            fast_path = find_fast_path(job, hits)
+            if fast_path:
+                job["fast_path"] = fast_path
+        return all_jobs
+
+    def find_fast_path(job, hits):
+        # A logistics question whose answer is already in a past Q&A or the
+        # materials is answered by quoting it, without calling Claude
+        classification = job.get("classification")
+        if config.FAST_PATH_LOGISTICS_ONLY and (classification is None or classification.category != "logistics"):
+            return None
+        metrics.increment("fast_path.checks")
+
+        # Closest hit of each kind across the configured collections, past Q&A first
+        closest = {}
+        for results in hits.values():
+            for result in results:
+                best = closest.get(result["kind"])
+                if best is None or result["distance"] < best["distance"]:
+                    closest[result["kind"]] = result
+        candidates = []
+        if "piazza" in closest:
+            candidates.append(("piazza", closest["piazza"], config.FAST_PATH_PIAZZA_DISTANCE))
+        if "materials" in closest:
+            candidates.append(("materials", closest["materials"], config.FAST_PATH_MATERIALS_DISTANCE))
+        for kind, result, threshold in candidates:
+            if result["distance"] <= threshold:
+                metrics.increment("fast_path.hits")
+                metrics.increment(f"fast_path.hits.{kind}")
+                logger.info(
+                    f"Post #{job['post_nr']} answered from {kind} hit {result['id']} "
+                    f"(distance {result['distance']:.3f} <= {threshold})"
+                )
+                return {"kind": kind, "result": result}
+            # Hits just outside the threshold show whether it could be loosened
+            if result["distance"] <= threshold * 1.5:
+                metrics.increment(f"fast_path.near_misses.{kind}")
+                logger.info(f"Post #{job['post_nr']} {kind} hit at distance {result['distance']:.3f} missed fast path")
+        return None
+
+    def generate(job):
+        post_nr = job["post_nr"]
+
+        if "draft" in job:
+            logger.info(f"Using batch draft for post #{post_nr}")
+            job["answer"] = job["draft"]
+            return job
+
+        hit = job.get("cache_hit")
+        if hit:
+            logger.info(f"Reusing cached answer from @{hit['post_nr']} for post #{post_nr}")
+            job["answer"] = adapt_answer(hit)
+            return job
+
+        fast_path = job.get("fast_path")
+        if fast_path:
+            logger.info(f"Answering post #{post_nr} from a {fast_path['kind']} excerpt")
+            job["answer"] = ai_answerer.templated_answer(fast_path["result"], fast_path["kind"])
+            return job
+
+        logger.info(f"Generating answer for post #{post_nr}: {job['subject'][:50]}")
+        set_status(job, db.STATUS_GENERATING)
+
+        result = ai_answerer.generate(
+            subject=job["subject"],
+            content=job["content"],
+            course_name=os.getenv("COURSE_NAME"),
+            api_key=os.getenv("ANTHROPIC_API_KEY"),
+            context=job["context"],
+            classification=job.get("classification"),
+        )
+
+        if result is None:
+            logger.warning(f"Failed to generate answer for post #{post_nr}")
+            set_status(job, db.STATUS_FAILED, "answer generation failed")
+            return None
+
+        if result.rejected:
+            # Regenerating would most likely trip the same guard, paying again each time
+            logger.warning(f"Answer for post #{post_nr} rejected by the {result.guard} guard, skipping the post")
+            set_status(job, db.STATUS_SKIPPED, f"answer rejected by {result.guard} guard")
+            return None
+
+        job["answer"] = result.text
+        job["answer_tokens"] = result.total_tokens
+        return job
+
+    def post(job):
+        post_nr = job["post_nr"]
+
+        # Append disclaimer
+        answer_with_disclaimer = job["answer"] + config.AI_DISCLAIMER
+
+        if piazza_client.post_answer(network, job["full_post"], answer_with_disclaimer):
+            set_status(job, db.STATUS_ANSWERED)
+            logger.info(f"Successfully posted answer to post #{post_nr}")
+            # Only answers Claude wrote are cached, so reused and quoted ones never chain
+            if answer_cache and "embedding" in job and "cache_hit" not in job and "fast_path" not in job:
+                try:
+                    answer_cache.add(
+                        job["post_id"], job["post_nr"], f"{job['subject']} {job['content']}",
+                        job["embedding"], job["answer"], job.get("answer_tokens", 0),
+                    )
+                except Exception as e:
+                    logger.warning(f"Error caching answer for post #{post_nr}: {e}")
+            return job
+
+        logger.warning(f"Failed to post answer to post #{post_nr}")
+        set_status(job, db.STATUS_FAILED, "could not post answer")
+        return None
+
+    return pipeline.Pipeline(
+        [
+            pipeline.Stage("fetch", fetch, workers=config.PIPELINE_FETCH_WORKERS),
+            pipeline.Stage(
+                "retrieve", retrieve,
+                workers=config.PIPELINE_RETRIEVE_WORKERS,
+                batch_size=config.PIPELINE_RETRIEVE_BATCH_SIZE,
+            ),
+            pipeline.Stage("generate", generate, workers=config.PIPELINE_GENERATE_WORKERS),
+            pipeline.Stage("post", post, workers=config.PIPELINE_POST_WORKERS),
+        ],
+        queue_size=config.PIPELINE_QUEUE_SIZE,
+    )
+
 
 def run_bot():
     """Main bot loop."""
@@ -33,16 +295,106 @@ def run_bot():
 
     # Initialize database
     conn = db.init_db(config.DB_PATH)
-    logger.info(f"Database initialized: {config.DB_PATH}")
+    post_states = db.load_post_states(conn)
+    logger.info(f"Database initialized: {config.DB_PATH} ({len(post_states)} tracked post(s))")
+
+    # Last seen feed markers and fetched full posts
+    snapshot = piazza_client.FeedSnapshot()
+
+    # State changes made during the current cycle, written in one transaction at its end
+    # (except "answered", which is written as soon as the answer is on Piazza)
+    state_lock = threading.Lock()
+    dirty_states = {}
+
+    def set_status(job, status, error=None):
+        now = datetime.utcnow()
+        with state_lock:
+            previous = post_states.get(job["post_id"]) or {}
+            attempts = previous.get("attempts", 0)
+            next_retry_at = None
+            if status == db.STATUS_FAILED:
+                attempts += 1
+                delay = min(config.POST_RETRY_MAX_SEC, config.POST_RETRY_BASE_SEC * 2 ** (attempts - 1))
+                next_retry_at = (now + timedelta(seconds=delay)).isoformat()
+                if attempts >= config.POST_MAX_ATTEMPTS:
+                    logger.warning(f"Post #{job['post_nr']} failed {attempts} times, giving up: {error}")
+                else:
+                    logger.info(f"Post #{job['post_nr']} failed ({error}), retry {attempts} in {delay}s")
+            state = {
+                "post_id": job["post_id"],
+                "post_nr": job["post_nr"] if isinstance(job["post_nr"], int) else 0,
+                "status": status,
+                "attempts": attempts,
+                "next_retry_at": next_retry_at,
+                "last_error": error,
+                "updated_at": now.isoformat(),
+                # A batch draft is kept until the post is done with, so a failed post can reuse it
+                "draft": None if status in db.FINAL_STATUSES else previous.get("draft"),
+            }
+            post_states[job["post_id"]] = state
+            if status == db.STATUS_ANSWERED:
+                # A crash before the end of the cycle must not lose this, or the
+                # post would be answered twice after a restart
+                dirty_states.pop(job["post_id"], None)
+                db.save_post_states(conn, [state])
+            else:
+                dirty_states[job["post_id"]] = state
+        if status in db.FINAL_STATUSES:
+            snapshot.forget_post(job["post_id"])
+
+    def flush_states(jobs):
+        # A job still pending/generating was dropped by an unexpected error
+        for job in jobs:
+            state = post_states.get(job["post_id"])
+            if state and state["status"] in (db.STATUS_PENDING, db.STATUS_GENERATING):
+                set_status(job, db.STATUS_FAILED, "dropped by pipeline error")
+        with state_lock:
+            if dirty_states:
+                db.save_post_states(conn, list(dirty_states.values()))
+                dirty_states.clear()
 
     # Initialize RAG retriever
     try:
-        retriever = Retriever(config.CHROMA_DB_PATH, config.EMBEDDING_MODEL)
+        retriever = Retriever(
+            config.CHROMA_DB_PATH,
+            config.EMBEDDING_MODEL,
+            max_distance=config.RAG_MAX_DISTANCE,
+            token_budget=config.RAG_CONTEXT_TOKEN_BUDGET,
+            collections=config.RAG_COLLECTIONS,
+            fusion_strategy=config.RAG_FUSION,
+            rrf_k=config.RAG_RRF_K,
+        )
         logger.info("RAG Retriever initialized")
     except Exception as e:
         logger.warning(f"Failed to initialize RAG retriever: {e}")
         retriever = None
 
+    # Initialize semantic answer cache
+    answer_cache = None
+    if config.ANSWER_CACHE_ENABLED:
+        try:
+            answer_cache = AnswerCache(
+                config.CHROMA_DB_PATH,
+                config.COLLECTION_ANSWER_CACHE,
+                embedding_model=config.EMBEDDING_MODEL,
+                max_distance=config.ANSWER_CACHE_MAX_DISTANCE,
+                ttl_sec=config.ANSWER_CACHE_TTL_SEC,
+            )
+            answer_cache.prune()
+        except Exception as e:
+            logger.warning(f"Failed to initialize answer cache: {e}")
+            answer_cache = None
+
+    # Local question triage for model routing
+    classifier = None
+    if config.ROUTING_ENABLED:
+        classifier = QuestionClassifier(
+            config.ROUTE_PROTOTYPES,
+            embedding_model=config.EMBEDDING_MODEL,
+            covered_distance=config.ROUTE_COVERED_DISTANCE,
+            long_question_words=config.ROUTE_LONG_QUESTION_WORDS,
+        )
+
     # Login to Piazza
     try:
         network = piazza_client.login(
@@ -54,103 +406,138 @@ def run_bot():
         logger.error(f"Failed to login to Piazza: {e}")
         sys.exit(1)
 
-    logger.info(f"Bot ready. Polling every {config.POLL_INTERVAL_SEC} seconds.")
+    # Piazza calls inside the stages share one rate limiter (see piazza_client._call)
+    post_pipeline = build_pipeline(network, retriever, answer_cache, classifier, snapshot, set_status)
+
+    scheduler = PollScheduler(
+        initial_interval=config.POLL_INTERVAL_SEC,
+        min_interval=config.POLL_INTERVAL_MIN_SEC,
+        max_interval=config.POLL_INTERVAL_MAX_SEC,
+        busy_factor=config.POLL_BUSY_FACTOR,
+        idle_factor=config.POLL_IDLE_FACTOR,
+        quiet_hours=config.POLL_QUIET_HOURS,
+        quiet_interval=config.POLL_QUIET_INTERVAL_SEC,
+    )
+
+    logger.info(
+        f"Bot ready. Polling every {config.POLL_INTERVAL_MIN_SEC}-{config.POLL_INTERVAL_MAX_SEC} seconds "
+        f"depending on activity."
+    )
     logger.info("=" * 60)
 
-    cycle_count = 0
-
-    try:
-        while True:
-            cycle_count += 1
-            logger.info(f"\n--- Poll Cycle #{cycle_count} ---")
-
-            # Get unread posts
-            unread = piazza_client.get_unread_posts(network)
-
-            if not unread:
-                logger.info("No unread posts found")
-            else:
-                logger.info(f"Processing {len(unread)} unread post(s)")
-
-            for item in unread:
+    # Newest feed marker seen so far; each walk stops at posts older than it
+    feed_cursor = db.get_sync_state(conn, FEED_CURSOR_KEY)
+
+    def load_batch_states():
+        # batch_answers.py writes batched/drafted states while the bot runs
+        with state_lock:
+            for post_id, state in db.load_post_states(conn, (db.STATUS_BATCHED, db.STATUS_DRAFTED)).items():
+                current = post_states.get(post_id)
+                if current is None or (current["updated_at"] or "") <= (state["updated_at"] or ""):
+                    post_states[post_id] = state
+
+    def new_job(post_id, post_nr, marker):
+        job = {"post_id": post_id, "post_nr": post_nr, "marker": marker}
+        state = post_states.get(post_id)
+        if state and state.get("draft"):
+            job["draft"] = state["draft"]
+        set_status(job, db.STATUS_PENDING)
+        return job
+
+    def candidate_jobs(since, jobs, newest):
+        """
+        Yield a job for every post that needs work, appending each to jobs.
+
+        newest collects the walk's newest marker, whether the walk completed,
+        and how many feed items were new or changed.
+        """
+        load_batch_states()
+        now = datetime.utcnow()
+        seen = set()
+        walk_limit = None if since else config.FEED_INITIAL_ITEMS
+
+        try:
+            for item in piazza_client.iter_unread_posts(network, since=since, limit=walk_limit):
                 post_id = item.get("id")
                 post_nr = item.get("nr", "?")
-
-                # Check if already answered
-                if db.already_answered(conn, post_id):
-                    logger.info(f"Post #{post_nr} ({post_id}) already answered, skipping")
+                seen.add(post_id)
+
+                marker = piazza_client.feed_item_marker(item)
+                if marker and (newest["marker"] is None or marker > newest["marker"]):
+                    newest["marker"] = marker
+
+                changed = snapshot.changed(item)
+                snapshot.remember(item)
+                if changed:
+                    newest["changed"] += 1
+
+                # Skip answered/skipped posts and failures not yet due for a retry,
+                # unless a failed post has been edited since it failed (the snapshot
+                # is empty after a restart, so the failure time decides)
+                state = post_states.get(post_id)
+                edited_failure = (
+                    changed and state is not None and state["status"] == db.STATUS_FAILED
+                    and piazza_client.modified_after(item, state["updated_at"])
+                )
+                if not edited_failure and not db.should_process(state, now, config.POST_MAX_ATTEMPTS):
+                    logger.debug(f"Post #{post_nr} ({post_id}) is {state['status']}, skipping")
                     continue
 
-                time.sleep(config.PIAZZA_CALL_SLEEP)
-
-                # Fetch full post
-                full_post = piazza_client.get_full_post(network, post_id)
-                if not full_post:
-                    logger.warning(f"Could not fetch full post {post_id}")
-                    continue
+                job = new_job(post_id, post_nr, marker)
+                jobs.append(job)
+                yield job
+            newest["complete"] = True
+        except Exception as e:
+            # Keep the old cursor so the next walk covers the posts this one missed
+            logger.error(f"Error fetching unread posts: {e}")
+
+        # Failures due for a retry and batch drafts sit below the cursor when
+        # their post hasn't changed
+        for post_id, state in list(post_states.items()):
+            if post_id in seen or state["status"] not in (db.STATUS_FAILED, db.STATUS_DRAFTED):
+                continue
+            if not db.should_process(state, now, config.POST_MAX_ATTEMPTS):
+                continue
+            job = new_job(post_id, state["post_nr"], snapshot.marker(post_id))
+            jobs.append(job)
+            yield job
 
-                # Check if we should answer
-                if not piazza_client.should_answer(full_post):
-                    logger.info(f"Post #{post_nr} does not meet criteria for answering, marking as skipped")
-                    db.mark_answered(conn, post_id, full_post.get("nr", 0))
-                    continue
+    cycle_count = 0
 
-                # Extract question content
-                history = full_post.get("history", [])
-                if not history:
-                    logger.warning(f"Post #{post_nr} has no history, skipping")
-                    db.mark_answered(conn, post_id, full_post.get("nr", 0))
-                    continue
+    try:
+        while True:
+            cycle_count += 1
+            logger.info(f"\n--- Poll Cycle #{cycle_count} ---")
 
-                first_version = history[0]
-                subject = first_version.get("subject", "(no subject)")
-                html_content = first_version.get("content", "")
-                content = piazza_client.strip_html(html_content)
+            jobs = []
+            newest = {"marker": feed_cursor, "complete": False, "changed": 0}
+            try:
+                # Feed pages stream into the pipeline as they arrive
+                posted = post_pipeline.run(candidate_jobs(feed_cursor, jobs, newest))
+            finally:
+                flush_states(jobs)
 
-                if not content:
-                    logger.warning(f"Post #{post_nr} has no content, skipping")
-                    db.mark_answered(conn, post_id, full_post.get("nr", 0))
-                    continue
+            if newest["complete"] and newest["marker"] and newest["marker"] != feed_cursor:
+                feed_cursor = newest["marker"]
+                db.set_sync_state(conn, FEED_CURSOR_KEY, feed_cursor)
 
-                logger.info(f"Generating answer for post #{post_nr}: {subject[:50]}")
-
-                # Retrieve context from RAG
-                rag_context = ""
-                if retriever:
-                    try:
-                        query_text = f"{subject} {content}"
-                        rag_context = retriever.query(query_text, top_k=config.RAG_TOP_K)
-                        if rag_context:
-                            logger.info("Retrieved context from RAG collections")
-                    except Exception as e:
-                        logger.warning(f"Error retrieving RAG context: {e}")
-
-                # Generate answer
-                answer = ai_answerer.generate_answer(
-                    subject=subject,
-                    content=content,
-                    course_name=os.getenv("COURSE_NAME"),
-                    api_key=os.getenv("ANTHROPIC_API_KEY"),
-                    context=rag_context,
+            if not jobs:
+                logger.info("No new or changed unread posts found")
+            else:
+                logger.info(f"Posted {len(posted)} of {len(jobs)} new post(s)")
+
+            if metrics.get("answer_cache.lookups"):
+                logger.info(
+                    f"Answer cache: {metrics.get('answer_cache.hits'):.0f} hit(s) in "
+                    f"{metrics.get('answer_cache.lookups'):.0f} lookup(s) "
+                    f"({metrics.ratio('answer_cache.hits', 'answer_cache.lookups'):.0%}), "
+                    f"{metrics.get('answer_cache.tokens_saved'):.0f} tokens saved"
                 )
 
-                if answer is None:
-                    logger.warning(f"Failed to generate answer for post #{post_nr}, will retry next cycle")
-                    continue
-
-                # Append disclaimer
-                answer_with_disclaimer = answer + config.AI_DISCLAIMER
-
-                # Post the answer
-                time.sleep(config.PIAZZA_CALL_SLEEP)
-                if piazza_client.post_answer(network, full_post, answer_with_disclaimer):
-                    db.mark_answered(conn, post_id, full_post.get("nr", 0))
-                    logger.info(f"Successfully posted answer to post #{post_nr}")
-                else:
-                    logger.warning(f"Failed to post answer to post #{post_nr}")
-
-            logger.info(f"Poll cycle complete. Sleeping for {config.POLL_INTERVAL_SEC} seconds...")
-            time.sleep(config.POLL_INTERVAL_SEC)
+            # Only new or edited feed items count as activity, not queued retries or drafts
+            interval = scheduler.next_interval(newest["changed"])
+            logger.info(f"Poll cycle complete. Sleeping for {interval:.0f} seconds...")
+            time.sleep(interval)
 
     except KeyboardInterrupt:
         logger.info("\nBot interrupted by user")
@@ -1,21 +1,140 @@
 # Piazza-Chimp Configuration
 # Tuneable constants for bot behavior
 
-POLL_INTERVAL_SEC = 60  # seconds between Piazza poll cycles
-PIAZZA_CALL_SLEEP = 2   # seconds between individual Piazza API calls (rate limiting)
+POLL_INTERVAL_SEC = 60  # initial seconds between Piazza poll cycles (adapted at runtime)
+FEED_INITIAL_ITEMS = 100  # feed items walked on the very first poll (later polls stop at the last-seen cursor)
+
+# Adaptive polling (poll_scheduler.py)
+POLL_INTERVAL_MIN_SEC = 15       # shortest interval while questions keep arriving
+POLL_INTERVAL_MAX_SEC = 300      # longest interval when the forum is quiet
+POLL_BUSY_FACTOR = 0.5           # interval multiplier after a cycle with new questions
+POLL_IDLE_FACTOR = 1.5           # interval multiplier after a cycle with none
+POLL_QUIET_HOURS = None          # optional local (start, end) hours of reduced polling, e.g. (2, 7)
+POLL_QUIET_INTERVAL_SEC = 900    # minimum interval during POLL_QUIET_HOURS, when set
+
+# Rate Limiting (rate_limit.py)
+# Token bucket per backend: (requests per second, burst size)
+RATE_LIMITS = {
+    "piazza": (0.5, 1),      # one Piazza API call every 2 seconds
+    "anthropic": (0.8, 5),   # ~50 requests/minute; raised to the real limit from response headers
+}
+BACKOFF_BASE_SEC = 2      # first backoff delay after an API error
+BACKOFF_MAX_SEC = 120     # backoff delay cap
+PIAZZA_MAX_RETRIES = 3    # retries for failed Piazza reads (writes are never retried)
+ANTHROPIC_RATE_LIMIT_RETRIES = 3  # retries after a Claude 429 before giving up on an answer
+
+# Pipeline Configuration (bot.py)
+PIPELINE_QUEUE_SIZE = 8          # max posts buffered in front of each stage
+PIPELINE_FETCH_WORKERS = 2       # full-post fetches (paced by the Piazza rate limit)
+PIPELINE_RETRIEVE_WORKERS = 1    # RAG lookups
+PIPELINE_RETRIEVE_BATCH_SIZE = 32  # max queued questions embedded together in one RAG lookup
+PIPELINE_GENERATE_WORKERS = 4    # concurrent Claude generations
+PIPELINE_POST_WORKERS = 1        # answer posting
 
 ANTHROPIC_MAX_TOKENS = 800
-MODEL = "claude-haiku-4-5-20251001"
+ANTHROPIC_STREAMING = True       # stream answers so the answer guards (ANSWER_*) can stop generation early
+ANTHROPIC_MAX_CONCURRENCY = 8  # max Claude requests in flight per process
+MODEL = "claude-haiku-4-5-20251001"  # default model, used when routing is off
+
+# Model routing: a local heuristic (embedding similarity to the ROUTE_PROTOTYPES
+# examples plus RAG hit distances) sends each question to a route
+ROUTING_ENABLED = True
+MODEL_ROUTES = {                 # route -> (model, max_tokens)
+    "logistics": ("claude-haiku-4-5-20251001", 300),
+    "simple": ("claude-haiku-4-5-20251001", 600),
+    "complex": ("claude-sonnet-4-5-20250929", 800),
+}
+ROUTE_DEFAULT = "complex"        # used when no route can be decided
+ROUTE_LLM_FALLBACK = True        # ask ROUTER_MODEL when the heuristic is unsure
+ROUTER_MODEL = "claude-haiku-4-5-20251001"
+ROUTE_MIN_CONFIDENCE = 0.05      # similarity margin over the runner-up category needed to trust the heuristic
+ROUTE_COVERED_DISTANCE = 0.35    # a RAG hit this close makes a question "simple"
+ROUTE_LONG_QUESTION_WORDS = 120  # longer questions are never "simple"
+ROUTE_PROTOTYPES = {
+    "logistics": [
+        "When is the homework due?",
+        "What room is the midterm in?",
+        "Is there lecture on Friday?",
+        "Can I get an extension on the lab?",
+        "How is the final grade calculated?",
+        "Where do I submit the assignment?",
+    ],
+    "conceptual": [
+        "Why does this algorithm run in O(n log n) time?",
+        "What is the difference between these two approaches?",
+        "Can someone explain how this proof works?",
+        "I don't understand the intuition behind this definition.",
+    ],
+    "debugging": [
+        "My code throws an error and I can't figure out why.",
+        "I get a segmentation fault when I run my program.",
+        "The autograder fails my test case but it works locally.",
+        "Why does my function return the wrong value?",
+    ],
+}
 
 DB_PATH = "piazza_bot.db"
 
+# Failed posts are retried with exponential backoff, then given up on
+POST_RETRY_BASE_SEC = 300        # delay before the first retry
+POST_RETRY_MAX_SEC = 6 * 3600    # retry delay cap
+POST_MAX_ATTEMPTS = 5            # failed attempts before a post is left alone
+
+# Logistics fast path: answer by quoting a very close RAG hit instead of calling Claude
+FAST_PATH_LOGISTICS_ONLY = True      # only for questions the router classifies as logistics
+FAST_PATH_PIAZZA_DISTANCE = 0.15     # cosine distance to a past Q&A (piazza_history) to quote it
+FAST_PATH_MATERIALS_DISTANCE = 0.12  # cosine distance to a course material chunk to quote it
+FAST_PATH_QUOTE_WORDS = 120          # longest quoted excerpt
+
+# Batch mode (batch_answers.py): drafts answers through the Message Batches API for the bot to post
+BATCH_MAX_REQUESTS = 1000        # posts submitted per batch run
+BATCH_POLL_SEC = 60              # delay between batch status checks
+BATCH_EXPIRY_SEC = 24 * 3600     # after this a batched post is presumed lost and answered live
+
+# Answer guards, applied while an answer streams in
+ANSWER_MAX_WORDS = 350           # longer answers are cut off and trimmed to this many words
+# An answer matching any of these is rejected. The same question would trip the same pattern
+# again, so the post is marked skipped rather than retried; keep patterns to actual leaks
+ANSWER_POLICY_PATTERNS = {
+    "full_solution": r"(?i)\b(?:here(?:'s| is)|below is) (?:the|a|my) (?:full|complete|entire|whole) "
+                     r"(?:solution|implementation|code|program)",
+    "answer_key": r"(?i)\b(?:here(?:'s| is| are)|below (?:is|are)|according to|copied from) "
+                  r"(?:the|an?|my) (?:official )?answer key\b",
+}
+
 AI_DISCLAIMER = "\n\n---\n*AI-generated draft — please verify with course staff.*"
 
 # RAG Configuration
 CHROMA_DB_PATH = "./chroma_db"
-EMBEDDING_MODEL = "all-MiniLM-L6-v2"
+EMBEDDING_MODEL = "all-MiniLM-L6-v2"  # used for ingestion and queries; recorded on each collection
+EMBEDDING_CACHE_PATH = "./embedding_cache.db"  # on-disk embedding cache used by the ingest scripts
 RAG_TOP_K = 5
+RAG_MAX_DISTANCE = 0.6           # cosine distance beyond which a result is left out of the prompt
+RAG_CONTEXT_TOKEN_BUDGET = 1500  # approximate context tokens per question, filled most relevant first
 RAG_CHUNK_SIZE = 512
 RAG_CHUNK_OVERLAP = 64
+INGEST_WORKERS = 1               # processes extracting/chunking files in ingest_materials.py
+INGEST_UPSERT_BATCH_SIZE = 256   # chunks embedded and upserted per batch during ingestion
+PIAZZA_INGEST_WORKERS = 4        # concurrent full-post fetches in ingest_piazza.py (rate still set by RATE_LIMITS)
+PIAZZA_INGEST_BATCH_SIZE = 50    # Q&A pairs upserted (and cursor checkpointed) per batch in ingest_piazza.py
 COLLECTION_MATERIALS = "course_materials"
 COLLECTION_PIAZZA = "piazza_history"
+COLLECTION_ANSWER_CACHE = "answer_cache"
+
+# Collections searched for context, all queried concurrently: name -> {"kind", "weight"}.
+# kind is "materials" (chunks of course files) or "piazza" (past Q&A pairs); add
+# e.g. a per-assignment collection filled with ingest_materials.py --collection
+RAG_COLLECTIONS = {
+    COLLECTION_MATERIALS: {"kind": "materials", "weight": 1.0},
+    COLLECTION_PIAZZA: {"kind": "piazza", "weight": 1.0},
+}
+# How the collections' results are ranked together. All collections share EMBEDDING_MODEL, so
+# "distance" compares them directly; "minmax" rescales each collection's scores, and "rrf" uses
+# ranks only (the best hit of every collection ties, whatever its distance)
+RAG_FUSION = "distance"
+RAG_RRF_K = 60       # reciprocal rank fusion damping; larger values weigh lower ranks more evenly
+
+# Semantic answer cache: reuse the bot's own earlier answer for a near-duplicate question
+ANSWER_CACHE_ENABLED = True
+ANSWER_CACHE_MAX_DISTANCE = 0.08  # cosine distance; keep tight so "lab 3" and "lab 4" stay distinct
+ANSWER_CACHE_TTL_SEC = 14 * 24 * 3600  # answers older than this (deadlines move) are not reused
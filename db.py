@@ -1,14 +1,53 @@
 # Piazza-Chimp Database Layer
-# SQLite persistence for tracking answered posts
+# SQLite persistence for tracking post state and ingestion state
 
 import sqlite3
 from datetime import datetime
 
+# Post states. A post moves pending -> generating -> answered, or ends up
+# skipped (not something the bot should answer) or failed (retried later).
+# Batch mode moves it batched -> drafted instead, and the bot posts the draft.
+STATUS_PENDING = "pending"
+STATUS_SKIPPED = "skipped"
+STATUS_GENERATING = "generating"
+STATUS_ANSWERED = "answered"
+STATUS_FAILED = "failed"
+STATUS_BATCHED = "batched"
+STATUS_DRAFTED = "drafted"
+
+# States that are never processed again
+FINAL_STATUSES = (STATUS_ANSWERED, STATUS_SKIPPED)
+
+_POST_STATE_COLUMNS = (
+    "post_id", "post_nr", "status", "attempts", "next_retry_at", "last_error", "updated_at", "draft"
+)
+
+# Collection that files in a manifest from before per-collection ingestion went into
+LEGACY_MANIFEST_COLLECTION = "course_materials"
+
+_MANIFEST_SCHEMA = """
+CREATE TABLE IF NOT EXISTS ingest_manifest (
+    collection TEXT NOT NULL,
+    path TEXT NOT NULL,
+    source TEXT,
+    mtime REAL,
+    size INTEGER,
+    content_hash TEXT,
+    chunk_count INTEGER,
+    ingested_at TEXT,
+    PRIMARY KEY (collection, path)
+)
+"""
+
 
 def init_db(db_path: str) -> sqlite3.Connection:
-    """Initialize database and create answered_posts table if not exists."""
-    conn = sqlite3.connect(db_path)
+    """Initialize database and create tables if they do not exist."""
+    # WAL lets the bot and ingest scripts read and write the same file concurrently;
+    # the timeout makes a writer wait for a lock instead of failing immediately.
+    conn = sqlite3.connect(db_path, timeout=30.0, check_same_thread=False)
     cursor = conn.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
     cursor.execute("""
         CREATE TABLE IF NOT EXISTS answered_posts (
             post_id TEXT PRIMARY KEY,
@@ -16,23 +55,201 @@ def init_db(db_path: str) -> sqlite3.Connection:
             answered_at TEXT
         )
     """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS post_state (
+            post_id TEXT PRIMARY KEY,
+            post_nr INTEGER,
+            status TEXT NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_retry_at TEXT,
+            last_error TEXT,
+            updated_at TEXT,
+            draft TEXT
+        )
+    """)
+    cursor.execute(_MANIFEST_SCHEMA)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS sync_state (
+            key TEXT PRIMARY KEY,
+            value TEXT,
+            updated_at TEXT
+        )
+    """)
     conn.commit()
+
+    # post_state tables created before batch mode have no draft column
+    cursor.execute("PRAGMA table_info(post_state)")
+    if "draft" not in [row[1] for row in cursor.fetchall()]:
+        cursor.execute("ALTER TABLE post_state ADD COLUMN draft TEXT")
+        conn.commit()
+
+    # ingest_manifest tables created before per-collection ingestion are keyed by path
+    # alone; every file in them went into the materials collection
+    cursor.execute("PRAGMA table_info(ingest_manifest)")
+    if "collection" not in [row[1] for row in cursor.fetchall()]:
+        cursor.execute("ALTER TABLE ingest_manifest RENAME TO ingest_manifest_old")
+        cursor.execute(_MANIFEST_SCHEMA)
+        cursor.execute(
+            "INSERT INTO ingest_manifest "
+            "(collection, path, source, mtime, size, content_hash, chunk_count, ingested_at) "
+            "SELECT ?, path, source, mtime, size, content_hash, chunk_count, ingested_at FROM ingest_manifest_old",
+            (LEGACY_MANIFEST_COLLECTION,)
+        )
+        cursor.execute("DROP TABLE ingest_manifest_old")
+        conn.commit()
+
+    # One-time migration: answered_posts did not distinguish answered from skipped
+    cursor.execute("SELECT 1 FROM post_state LIMIT 1")
+    if cursor.fetchone() is None:
+        cursor.execute(
+            "INSERT OR IGNORE INTO post_state (post_id, post_nr, status, attempts, updated_at) "
+            "SELECT post_id, post_nr, ?, 0, answered_at FROM answered_posts",
+            (STATUS_ANSWERED,)
+        )
+        conn.commit()
+
     return conn
 
 
 def already_answered(conn: sqlite3.Connection, post_id: str) -> bool:
-    """Check if a post has already been answered by the bot."""
+    """Check if a post has already been answered (or deliberately skipped) by the bot."""
     cursor = conn.cursor()
-    cursor.execute("SELECT 1 FROM answered_posts WHERE post_id = ?", (post_id,))
+    cursor.execute(
+        f"SELECT 1 FROM post_state WHERE post_id = ? AND status IN ({','.join('?' * len(FINAL_STATUSES))})",
+        (post_id, *FINAL_STATUSES)
+    )
     return cursor.fetchone() is not None
 
 
 def mark_answered(conn: sqlite3.Connection, post_id: str, post_nr: int) -> None:
     """Mark a post as answered, recording the timestamp."""
+    now = datetime.utcnow().isoformat()
+    save_post_states(conn, [{
+        "post_id": post_id,
+        "post_nr": post_nr,
+        "status": STATUS_ANSWERED,
+        "attempts": 0,
+        "next_retry_at": None,
+        "last_error": None,
+        "updated_at": now,
+    }])
+
+
+def load_post_states(conn: sqlite3.Connection, statuses: tuple[str, ...] | None = None) -> dict:
+    """Load tracked posts (optionally only those in the given statuses) as {post_id: state dict}."""
+    cursor = conn.cursor()
+    query = f"SELECT {', '.join(_POST_STATE_COLUMNS)} FROM post_state"
+    if statuses:
+        cursor.execute(f"{query} WHERE status IN ({','.join('?' * len(statuses))})", statuses)
+    else:
+        cursor.execute(query)
+    return {row[0]: dict(zip(_POST_STATE_COLUMNS, row)) for row in cursor.fetchall()}
+
+
+def save_post_states(conn: sqlite3.Connection, states: list[dict]) -> None:
+    """Insert or replace several post states in a single transaction."""
+    with conn:
+        conn.executemany(
+            f"INSERT OR REPLACE INTO post_state ({', '.join(_POST_STATE_COLUMNS)}) "
+            f"VALUES ({', '.join('?' * len(_POST_STATE_COLUMNS))})",
+            [tuple(state.get(col) for col in _POST_STATE_COLUMNS) for state in states]
+        )
+
+
+def should_process(state: dict | None, now: datetime, max_attempts: int) -> bool:
+    """
+    Decide whether a post needs (another) attempt.
+
+    New posts, drafted posts and posts left pending/generating by an
+    interrupted run are processed; answered and skipped posts never are;
+    failed posts are retried once their next_retry_at has passed, up to
+    max_attempts. Batched posts wait for their batch until next_retry_at,
+    after which the batch is presumed lost.
+    """
+    if state is None:
+        return True
+    status = state["status"]
+    if status in FINAL_STATUSES:
+        return False
+    if status == STATUS_BATCHED:
+        next_retry_at = state.get("next_retry_at")
+        return not next_retry_at or datetime.fromisoformat(next_retry_at) <= now
+    if status == STATUS_FAILED:
+        if state["attempts"] >= max_attempts:
+            return False
+        next_retry_at = state.get("next_retry_at")
+        return not next_retry_at or datetime.fromisoformat(next_retry_at) <= now
+    return True
+
+
+def should_batch(state: dict | None, now: datetime, max_attempts: int) -> bool:
+    """
+    Decide whether batch mode should draft an answer for a post.
+
+    Like should_process, but drafted posts (waiting for the bot to post them)
+    and pending/generating posts (possibly being answered by the bot right
+    now) are left alone.
+    """
+    if state is not None and state["status"] in (STATUS_DRAFTED, STATUS_PENDING, STATUS_GENERATING):
+        return False
+    return should_process(state, now, max_attempts)
+
+
+def get_manifest(conn: sqlite3.Connection, collection: str) -> dict:
+    """Return the materials ingest manifest of one collection as {path: entry dict}."""
+    cursor = conn.cursor()
+    cursor.execute(
+        "SELECT path, source, mtime, size, content_hash, chunk_count, ingested_at FROM ingest_manifest "
+        "WHERE collection = ?",
+        (collection,)
+    )
+    columns = [col[0] for col in cursor.description]
+    return {row[0]: dict(zip(columns, row)) for row in cursor.fetchall()}
+
+
+def save_manifest_entry(
+    conn: sqlite3.Connection,
+    collection: str,
+    path: str,
+    source: str,
+    mtime: float,
+    size: int,
+    content_hash: str,
+    chunk_count: int,
+) -> None:
+    """Record the state of a file ingested into a collection."""
+    cursor = conn.cursor()
+    now = datetime.utcnow().isoformat()
+    cursor.execute(
+        "INSERT OR REPLACE INTO ingest_manifest "
+        "(collection, path, source, mtime, size, content_hash, chunk_count, ingested_at) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+        (collection, path, source, mtime, size, content_hash, chunk_count, now)
+    )
+    conn.commit()
+
+
+def delete_manifest_entry(conn: sqlite3.Connection, collection: str, path: str) -> None:
+    """Forget a file that is no longer ingested into a collection."""
+    cursor = conn.cursor()
+    cursor.execute("DELETE FROM ingest_manifest WHERE collection = ? AND path = ?", (collection, path))
+    conn.commit()
+
+
+def get_sync_state(conn: sqlite3.Connection, key: str) -> str | None:
+    """Return a stored sync cursor value, or None if never set."""
+    cursor = conn.cursor()
+    cursor.execute("SELECT value FROM sync_state WHERE key = ?", (key,))
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+
+def set_sync_state(conn: sqlite3.Connection, key: str, value: str) -> None:
+    """Store a sync cursor value."""
     cursor = conn.cursor()
     now = datetime.utcnow().isoformat()
     cursor.execute(
-        "INSERT OR IGNORE INTO answered_posts (post_id, post_nr, answered_at) VALUES (?, ?, ?)",
-        (post_id, post_nr, now)
+        "INSERT OR REPLACE INTO sync_state (key, value, updated_at) VALUES (?, ?, ?)",
+        (key, value, now)
     )
     conn.commit()
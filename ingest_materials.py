@@ -1,14 +1,18 @@
 #!/usr/bin/env python3
 # Ingest course materials into ChromaDB
-# Usage: python ingest_materials.py --dir ./course_files [--ext pdf,md,txt]
+# Usage: python ingest_materials.py --dir ./course_files [--ext pdf,md,txt] [--full] [--workers N]
+#        [--include GLOB ...] [--exclude GLOB ...] [--collection NAME]
 
 import argparse
+import functools
 import logging
 import sys
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
 from pathlib import Path
 
 import config
-from rag import vector_store, ingester
+import db
+from rag import embedder, vector_store, ingester
 
 # Setup logging
 logging.basicConfig(
@@ -18,6 +22,111 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
+def prepare_files(tasks, workers: int, full: bool):
+    """
+    Hash, load and chunk files, in a process pool when workers > 1.
+
+    Tasks are consumed lazily with a bounded number in flight, so files are
+    processed while discovery is still walking the tree. Yields (task, result)
+    pairs as files finish, so the caller can write results while other files
+    are still being extracted.
+    """
+    def submit_args(task):
+        entry = task["entry"]
+        previous_hash = entry["content_hash"] if entry and not full else None
+        return (
+            str(task["file_path"]),
+            task["rel_path"],
+            config.RAG_CHUNK_SIZE,
+            config.RAG_CHUNK_OVERLAP,
+            previous_hash,
+            task["rel_path"],
+        )
+
+    if workers <= 1:
+        for task in tasks:
+            try:
+                yield task, ingester.prepare_file(*submit_args(task))
+            except Exception as e:
+                logger.error(f"Error ingesting {task['file_path']}: {e}")
+        return
+
+    max_in_flight = workers * 4
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = {}
+        task_iter = iter(tasks)
+        exhausted = False
+
+        while pending or not exhausted:
+            while not exhausted and len(pending) < max_in_flight:
+                task = next(task_iter, None)
+                if task is None:
+                    exhausted = True
+                    break
+                pending[executor.submit(ingester.prepare_file, *submit_args(task))] = task
+
+            if not pending:
+                break
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                task = pending.pop(future)
+                try:
+                    yield task, future.result()
+                except Exception as e:
+                    logger.error(f"Error ingesting {task['file_path']}: {e}")
+
+
+def discover_tasks(materials_dir: Path, extensions: list[str], include, exclude,
+                   manifest: dict, full: bool, counts: dict, seen_paths: set):
+    """
+    Walk the materials tree and yield a task for every new or changed file.
+
+    Files whose size and mtime match the manifest are counted as unchanged
+    without being read. Every matching path is added to seen_paths.
+
+    Chunk ids and source labels come from the path relative to --dir, so a
+    file whose relative path is already ingested into the collection from
+    another --dir is refused rather than allowed to overwrite or delete that
+    file's chunks.
+    """
+    label_owners = {entry["source"]: path_key for path_key, entry in manifest.items()}
+    for file_path in ingester.iter_files(str(materials_dir), extensions, include=include, exclude=exclude):
+        path_key = str(file_path.resolve())
+        seen_paths.add(path_key)
+        counts["found"] += 1
+        entry = manifest.get(path_key)
+        rel_path = file_path.relative_to(materials_dir).as_posix()
+
+        owner = label_owners.get(rel_path, path_key)
+        if owner != path_key:
+            logger.error(
+                f"Skipping {file_path}: {rel_path} is already ingested into this collection from {owner}; "
+                f"ingest it with another --collection or from a common --dir"
+            )
+            counts["conflicting"] += 1
+            continue
+
+        try:
+            stat = file_path.stat()
+        except OSError as e:
+            logger.error(f"Error reading {file_path}: {e}")
+            continue
+
+        # Same size and mtime: assume unchanged without reading the file
+        if (not full and entry
+                and entry["mtime"] == stat.st_mtime and entry["size"] == stat.st_size):
+            counts["unchanged"] += 1
+            continue
+
+        yield {
+            "file_path": file_path,
+            "rel_path": rel_path,
+            "path_key": path_key,
+            "entry": entry,
+            "stat": stat,
+        }
+
+
 def main():
     parser = argparse.ArgumentParser(
         description="Ingest course materials into ChromaDB"
@@ -34,6 +143,35 @@ def main():
         default="pdf,md,txt",
         help="Comma-separated file extensions to process (default: pdf,md,txt)"
     )
+    parser.add_argument(
+        "--full",
+        action="store_true",
+        help="Re-ingest every file, ignoring the manifest of previous runs"
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=config.INGEST_WORKERS,
+        help=f"Processes used to extract and chunk files (default: {config.INGEST_WORKERS})"
+    )
+    parser.add_argument(
+        "--collection",
+        type=str,
+        default=config.COLLECTION_MATERIALS,
+        help=f"Collection to ingest into; list it in RAG_COLLECTIONS (default: {config.COLLECTION_MATERIALS})"
+    )
+    parser.add_argument(
+        "--include",
+        action="append",
+        default=[],
+        help="Only ingest files whose path relative to --dir matches this glob (repeatable)"
+    )
+    parser.add_argument(
+        "--exclude",
+        action="append",
+        default=[],
+        help="Skip files and directories whose relative path matches this glob (repeatable)"
+    )
 
     args = parser.parse_args()
 
@@ -51,38 +189,105 @@ def main():
         logger.error(f"Not a directory: {materials_dir}")
         sys.exit(1)
 
+    # Reuse embeddings of unchanged text from earlier runs
+    embedder.enable_cache(config.EMBEDDING_CACHE_PATH)
+
     # Initialize ChromaDB
     client = vector_store.init_store(config.CHROMA_DB_PATH)
-    collection = vector_store.get_or_create_collection(
-        client, config.COLLECTION_MATERIALS
-    )
+    try:
+        collection = vector_store.get_or_create_collection(
+            client, args.collection, config.EMBEDDING_MODEL
+        )
+    except ValueError as e:
+        logger.error(str(e))
+        sys.exit(1)
 
-    # Scan and ingest files
-    files_to_ingest = []
-    for ext in extensions:
-        files_to_ingest.extend(materials_dir.glob(f"*{ext}"))
+    # Manifest of what previous runs ingested into this collection, keyed by absolute path
+    conn = db.init_db(config.DB_PATH)
+    manifest = db.get_manifest(conn, args.collection)
 
-    if not files_to_ingest:
-        logger.warning(f"No files found with extensions {extensions} in {materials_dir}")
-        sys.exit(0)
+    counts = {"found": 0, "new": 0, "modified": 0, "unchanged": 0, "removed": 0, "conflicting": 0, "failed": 0}
+    seen_paths = set()
 
-    logger.info(f"Found {len(files_to_ingest)} file(s) to ingest")
+    # Files stream from the directory walk straight into the workers
+    tasks = discover_tasks(
+        materials_dir, extensions, args.include, args.exclude, manifest, args.full, counts, seen_paths
+    )
+
+    # Workers extract and chunk; this process alone embeds and writes to the store
+    writer = ingester.BatchUpserter(
+        collection, config.EMBEDDING_MODEL, batch_size=config.INGEST_UPSERT_BATCH_SIZE
+    )
+    for task, result in prepare_files(tasks, args.workers, args.full):
+        file_path, path_key, entry, stat = task["file_path"], task["path_key"], task["entry"], task["stat"]
+        rel_path = task["rel_path"]
 
-    total_chunks = 0
-    for file_path in sorted(files_to_ingest):
         try:
-            chunks_added = ingester.ingest_file(
-                str(file_path),
-                collection,
-                source_label=file_path.name,
-                chunk_size=config.RAG_CHUNK_SIZE,
-                overlap=config.RAG_CHUNK_OVERLAP,
-            )
-            total_chunks += chunks_added
+            if result["chunks"] is None:
+                db.save_manifest_entry(
+                    conn, args.collection, path_key, entry["source"], stat.st_mtime, stat.st_size,
+                    result["content_hash"], entry["chunk_count"],
+                )
+                counts["unchanged"] += 1
+                continue
+
+            # Drop the old version's chunks so a shorter file leaves no stale tail
+            if entry:
+                vector_store.delete_source(collection, entry["source"])
+            else:
+                # Stores built before the manifest labelled top-level files by name, which
+                # equals rel_path; clear them so the file's passages are not stored twice
+                # (discover_tasks has made sure no other manifest file owns this label)
+                vector_store.delete_source(collection, rel_path)
+
+            # Only record the file once its chunks are actually in the store
+            writer.add(result["chunks"], on_written=functools.partial(
+                db.save_manifest_entry, conn, args.collection, path_key, rel_path, stat.st_mtime, stat.st_size,
+                result["content_hash"], len(result["chunks"]),
+            ))
+            counts["modified" if entry else "new"] += 1
         except Exception as e:
             logger.error(f"Error ingesting {file_path}: {e}")
+            counts["failed"] += 1
+
+    # Files still buffered are not recorded in the manifest if this fails,
+    # so the next run ingests them again
+    try:
+        writer.flush()
+    except Exception as e:
+        logger.error(f"Error writing the last batch ({writer.pending} file(s)): {e}")
+        counts["failed"] += writer.pending
+    total_chunks = writer.written
+
+    if not counts["found"]:
+        logger.warning(f"No files found with extensions {extensions} in {materials_dir}")
+    else:
+        logger.info(f"Found {counts['found']} matching file(s)")
 
-    logger.info(f"Ingestion complete. Total chunks added: {total_chunks}")
+    # Remove chunks of files under --dir that were deleted or are no longer matched
+    root = materials_dir.resolve()
+    for path_key, entry in manifest.items():
+        path = Path(path_key)
+        if path_key in seen_paths or not path.is_relative_to(root) or path.suffix.lower() not in extensions:
+            continue
+        try:
+            vector_store.delete_source(collection, entry["source"])
+            db.delete_manifest_entry(conn, args.collection, path_key)
+            counts["removed"] += 1
+            logger.info(f"Removed chunks for {entry['source']}")
+        except Exception as e:
+            logger.error(f"Error removing chunks for {path_key}: {e}")
+
+    conn.close()
+
+    logger.info(
+        f"Ingestion complete. {counts['new']} new, {counts['modified']} modified, "
+        f"{counts['unchanged']} unchanged, {counts['removed']} removed file(s), "
+        f"{counts['conflicting']} skipped (already ingested from another --dir), {counts['failed']} failed. "
+        f"Total chunks added: {total_chunks}"
+    )
+    stats = embedder.cache_stats()
+    logger.info(f"Embedding cache: {stats['hits']} hits, {stats['misses']} misses")
 
 
 if __name__ == "__main__":
@@ -1,16 +1,22 @@
 #!/usr/bin/env python3
 # Ingest Piazza Q&A history into ChromaDB
-# Usage: python ingest_piazza.py
+# Usage: python ingest_piazza.py [--full] [--workers N] [--rate REQ_PER_SEC]
 
+import argparse
+import functools
+import json
 import logging
 import sys
 import os
-import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 
 import config
+import db
 import piazza_client
-from rag import vector_store
+import rate_limit
+from rag import embedder, ingester, vector_store
 
 # Load environment variables
 load_dotenv()
@@ -22,6 +28,9 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# sync_state key holding the (modified, nr) position of the last ingested feed item
+SYNC_CURSOR_KEY = "piazza_history_cursor"
+
 
 def extract_qa_pair(post: dict) -> str | None:
     """
@@ -64,7 +73,73 @@ def extract_qa_pair(post: dict) -> str | None:
     return qa_pair
 
 
+def load_cursor(conn) -> tuple[str, int] | None:
+    """Load the sync cursor saved by the previous run, if any."""
+    value = db.get_sync_state(conn, SYNC_CURSOR_KEY)
+    if not value:
+        return None
+    data = json.loads(value)
+    return data["modified"], data["nr"]
+
+
+def save_cursor(conn, cursor: tuple[str, int]) -> None:
+    """Persist the sync cursor so the next run starts after it."""
+    db.set_sync_state(conn, SYNC_CURSOR_KEY, json.dumps({"modified": cursor[0], "nr": cursor[1]}))
+
+
+def fetch_posts(network, feed_items: list[dict], workers: int):
+    """
+    Fetch full posts concurrently, yielding (item, full_post) in feed order.
+
+    Up to `workers` requests run at once, all drawing from the shared
+    Piazza token bucket, so the global request rate stays within budget.
+    Transient failures are retried inside piazza_client.get_full_post.
+    Results are yielded in input order so the sync cursor stays monotonic.
+    """
+    max_in_flight = workers * 4
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="piazza-fetch") as executor:
+        pending = deque()
+        items = iter(feed_items)
+
+        for item in items:
+            pending.append((item, executor.submit(piazza_client.get_full_post, network, item.get("id"))))
+            if len(pending) >= max_in_flight:
+                break
+
+        while pending:
+            item, future = pending.popleft()
+            next_item = next(items, None)
+            if next_item is not None:
+                pending.append((next_item, executor.submit(piazza_client.get_full_post, network, next_item.get("id"))))
+            yield item, future.result()
+
+
 def main():
+    parser = argparse.ArgumentParser(
+        description="Ingest Piazza Q&A history into ChromaDB"
+    )
+    parser.add_argument(
+        "--full",
+        action="store_true",
+        help="Ignore the saved sync cursor and re-crawl the whole feed"
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=config.PIAZZA_INGEST_WORKERS,
+        help=f"Concurrent full-post fetches (default: {config.PIAZZA_INGEST_WORKERS})"
+    )
+    parser.add_argument(
+        "--rate",
+        type=float,
+        default=None,
+        help="Global Piazza request budget in requests/second (default: config.RATE_LIMITS['piazza'])"
+    )
+    args = parser.parse_args()
+
+    if args.rate:
+        rate_limit.get_bucket("piazza").set_rate(args.rate)
+
     logger.info("=" * 60)
     logger.info("Ingesting Piazza Q&A History")
     logger.info("=" * 60)
@@ -85,80 +160,110 @@ def main():
         logger.error(f"Failed to login to Piazza: {e}")
         sys.exit(1)
 
+    # Reuse embeddings of unchanged text from earlier runs
+    embedder.enable_cache(config.EMBEDDING_CACHE_PATH)
+
     # Initialize ChromaDB
     client = vector_store.init_store(config.CHROMA_DB_PATH)
-    collection = vector_store.get_or_create_collection(
-        client, config.COLLECTION_PIAZZA
-    )
+    try:
+        collection = vector_store.get_or_create_collection(
+            client, config.COLLECTION_PIAZZA, config.EMBEDDING_MODEL
+        )
+    except ValueError as e:
+        logger.error(str(e))
+        sys.exit(1)
+
+    # Sync cursor from the previous run
+    conn = db.init_db(config.DB_PATH)
+    cursor = None if args.full else load_cursor(conn)
+    if cursor:
+        logger.info(f"Resuming sync after posts modified at {cursor[0]} (@{cursor[1]})")
 
-    # Fetch posts - try to get all posts
-    logger.info("Fetching all posts from Piazza...")
+    # Page through the feed, stopping at posts older than the cursor
+    logger.info("Fetching posts from Piazza...")
     try:
-        # Try with a large limit first (Piazza API may have max limit)
-        feed = network.get_feed(limit=10000)
-        feed_items = feed.get("feed", [])
+        feed_items = list(piazza_client.iter_feed(network, since=cursor[0] if cursor else None))
         logger.info(f"Found {len(feed_items)} posts in feed")
     except Exception as e:
         logger.error(f"Error fetching feed: {e}")
         sys.exit(1)
 
-    # Extract Q&A pairs
-    chunks = []
+    # Only posts created or updated since the last sync, oldest first, so the
+    # cursor can advance past each one as soon as it is stored
+    if cursor:
+        feed_items = [item for item in feed_items if piazza_client.feed_item_cursor(item) > cursor]
+    feed_items.sort(key=piazza_client.feed_item_cursor)
+    logger.info(f"{len(feed_items)} post(s) new or updated since last sync")
+
+    # Extract Q&A pairs and stream them into Chroma in fixed-size batches.
+    # The cursor for a post is saved only after everything before it is written.
+    writer = ingester.BatchUpserter(
+        collection, config.EMBEDDING_MODEL, batch_size=config.PIAZZA_INGEST_BATCH_SIZE
+    )
     qa_count = 0
     skipped_count = 0
+    # Once a post fails, stop advancing the cursor so the next run retries it
+    cursor_blocked = False
 
-    for item in feed_items:
-        post_id = item.get("id")
-        post_nr = item.get("nr", "?")
-
-        try:
-            time.sleep(config.PIAZZA_CALL_SLEEP)
-            full_post = piazza_client.get_full_post(network, post_id)
-
-            if not full_post:
-                logger.debug(f"Could not fetch post {post_id}")
+    try:
+        for item, full_post in fetch_posts(network, feed_items, max(1, args.workers)):
+            post_id = item.get("id")
+            post_nr = item.get("nr", "?")
+            chunks = []
+
+            try:
+                if not full_post:
+                    logger.warning(f"Could not fetch post {post_id}, it will be retried next run")
+                    skipped_count += 1
+                    cursor_blocked = True
+                    continue
+
+                # Skip if not a question
+                if full_post.get("type") != "question":
+                    skipped_count += 1
+                else:
+                    # Try to extract Q&A pair
+                    qa_pair = extract_qa_pair(full_post)
+                    if not qa_pair:
+                        skipped_count += 1
+                    else:
+                        tags = full_post.get("tags", [])
+                        is_numeric_nr = isinstance(post_nr, (int, str)) and str(post_nr).isdigit()
+                        chunks.append({
+                            "id": post_id,
+                            "text": qa_pair,
+                            "metadata": {
+                                "post_nr": int(post_nr) if is_numeric_nr else 0,
+                                "tags": ",".join(tags),
+                            }
+                        })
+                        qa_count += 1
+
+                        if qa_count % 10 == 0:
+                            logger.info(f"Extracted {qa_count} Q&A pairs so far...")
+
+                checkpoint = None
+                if not cursor_blocked:
+                    checkpoint = functools.partial(save_cursor, conn, piazza_client.feed_item_cursor(item))
+                writer.add(chunks, on_written=checkpoint)
+
+            except Exception as e:
+                logger.error(f"Error processing post {post_id}: {e}")
                 skipped_count += 1
-                continue
+                cursor_blocked = True
 
-            # Skip if not a question
-            if full_post.get("type") != "question":
-                skipped_count += 1
-                continue
+    except KeyboardInterrupt:
+        logger.info("Interrupted, writing buffered Q&A pairs before exiting...")
+        writer.flush()
+        conn.close()
+        sys.exit(1)
 
-            # Try to extract Q&A pair
-            qa_pair = extract_qa_pair(full_post)
-            if not qa_pair:
-                skipped_count += 1
-                continue
-
-            # Add to chunks
-            tags = full_post.get("tags", [])
-            chunks.append({
-                "id": post_id,
-                "text": qa_pair,
-                "metadata": {
-                    "post_nr": int(post_nr) if isinstance(post_nr, (int, str)) and str(post_nr).isdigit() else 0,
-                    "tags": ",".join(tags),
-                }
-            })
-            qa_count += 1
-
-            if qa_count % 10 == 0:
-                logger.info(f"Extracted {qa_count} Q&A pairs so far...")
-
-        except Exception as e:
-            logger.error(f"Error processing post {post_id}: {e}")
-            skipped_count += 1
-
-    # Upsert to ChromaDB
-    if chunks:
-        logger.info(f"Upserting {len(chunks)} Q&A pairs to ChromaDB...")
-        vector_store.upsert_chunks(collection, chunks)
-        logger.info(f"Successfully ingested {qa_count} Q&A pairs")
-    else:
-        logger.info("No Q&A pairs found to ingest")
-
-    logger.info(f"Summary: {qa_count} Q&A pairs ingested, {skipped_count} posts skipped")
+    writer.flush()
+    conn.close()
+
+    logger.info(f"Summary: {writer.written} Q&A pairs ingested, {skipped_count} posts skipped")
+    stats = embedder.cache_stats()
+    logger.info(f"Embedding cache: {stats['hits']} hits, {stats['misses']} misses")
     logger.info("=" * 60)
 
 
@@ -0,0 +1,32 @@
+# Piazza-Chimp Metrics
+# Process-wide counters shared by the pipeline threads
+
+import threading
+
+_counters = {}
+_lock = threading.Lock()
+
+
+def increment(name: str, amount: float = 1) -> None:
+    """Add amount to a named counter, creating it at zero on first use."""
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + amount
+
+
+def get(name: str) -> float:
+    """Return a counter's current value (0 if it was never incremented)."""
+    with _lock:
+        return _counters.get(name, 0)
+
+
+def snapshot() -> dict:
+    """Return a copy of every counter."""
+    with _lock:
+        return dict(_counters)
+
+
+def ratio(numerator: str, denominator: str) -> float:
+    """Return numerator / denominator for two counters, or 0.0 if the denominator is zero."""
+    with _lock:
+        total = _counters.get(denominator, 0)
+        return _counters.get(numerator, 0) / total if total else 0.0
@@ -1,11 +1,15 @@
 # Piazza-Chimp Piazza API Wrappers
 # Read/write operations with filtering logic
 
-import time
 import logging
+import threading
+from datetime import datetime, timezone
 from html.parser import HTMLParser
 from piazza_api import Piazza
 
+import config
+import rate_limit
+
 logger = logging.getLogger(__name__)
 
 
@@ -25,6 +29,55 @@ class HTMLStripper(HTMLParser):
         return ''.join(self.text)
 
 
+# Error text that marks a failure as worth backing off and retrying
+_TRANSIENT_ERROR_HINTS = ("429", "too many requests", "rate limit", "try again", "timed out", "temporarily")
+
+
+def _is_transient(error: Exception) -> bool:
+    """True for rate limiting, server errors and connection problems; False for errors such as a permission denial."""
+    status = getattr(getattr(error, "response", None), "status_code", None)
+    if status is not None:
+        return status == 429 or status >= 500
+    # Connection errors and timeouts (requests' exceptions are OSErrors too)
+    if isinstance(error, OSError):
+        return True
+    message = str(error).lower()
+    return any(hint in message for hint in _TRANSIENT_ERROR_HINTS)
+
+
+def _call(method, *args, retries: int = 0, **kwargs):
+    """
+    Call a Piazza API method under the shared Piazza rate limit.
+
+    Every call takes a token from the "piazza" bucket. A transient failure
+    (rate limiting, a server or connection error) pauses the bucket for an
+    exponentially growing delay (reset by the next success), so all threads
+    back off together. Other errors, such as the permission error that
+    post_answer expects from create_instructor_answer, are raised at once
+    without pausing anyone. Only pass retries > 0 for reads; writes such as
+    posting an answer are not safe to repeat.
+    """
+    bucket = rate_limit.get_bucket("piazza")
+    backoff = rate_limit.get_backoff("piazza")
+    attempt = 0
+    while True:
+        bucket.acquire()
+        try:
+            result = method(*args, **kwargs)
+        except Exception as e:
+            if not _is_transient(e):
+                raise
+            delay = backoff.failure()
+            bucket.pause(delay)
+            if attempt >= retries:
+                raise
+            attempt += 1
+            logger.warning(f"Piazza call failed ({e}), retry {attempt}/{retries} in {delay:.0f}s")
+            continue
+        backoff.success()
+        return result
+
+
 def login(email: str, password: str, network_id: str):
     """Login to Piazza and return the Network object."""
     logger.info("Logging in to Piazza...")
@@ -35,32 +88,164 @@ def login(email: str, password: str, network_id: str):
     return network
 
 
-def get_unread_posts(network) -> list:
-    """Get list of unread posts from the feed."""
-    logger.info("Fetching unread posts...")
-    try:
-        # Use get_feed() instead of get_filtered_feed() to avoid RPC issues
-        feed = network.get_feed(limit=100)
-        feed_items = feed.get("feed", [])
+def iter_feed(network, page_size: int = 100, since: str | None = None, limit: int | None = None):
+    """
+    Walk the feed lazily, one page at a time, most recently active first.
 
+    Pages are requested only as the caller consumes items, so a caller can
+    start working on the first page while later ones are still unfetched.
+
+    Args:
+        network: Piazza Network object
+        page_size: Items requested per get_feed call
+        since: Modification marker from a previous walk; stop at the first
+            (non-pinned) item modified before it
+        limit: Optional maximum number of items to yield
+
+    Yields:
+        Feed item dicts
+    """
+    offset = 0
+    yielded = 0
+    while True:
+        page = _call(network.get_feed, limit=page_size, offset=offset, retries=config.PIAZZA_MAX_RETRIES)
+        items = page.get("feed", [])
+
+        for item in items:
+            # Pinned posts sit at the top regardless of age, so they don't end the walk
+            marker = feed_item_marker(item)
+            if since and marker and marker < since and not item.get("pin"):
+                return
+            yield item
+            yielded += 1
+            if limit is not None and yielded >= limit:
+                return
+
+        if len(items) < page_size:
+            return
+        offset += len(items)
+
+
+def iter_unread_posts(network, since: str | None = None, limit: int | None = None):
+    """
+    Yield unread posts from the feed as its pages arrive.
+
+    Args:
+        network: Piazza Network object
+        since: Stop at posts not modified since this marker (see iter_feed)
+        limit: Optional maximum number of feed items to walk
+
+    Yields:
+        Feed items with unread followups or updates
+    """
+    logger.info("Fetching unread posts...")
+    found = 0
+    for item in iter_feed(network, since=since, limit=limit):
         # Filter for unread posts (posts with unread followups or updates)
-        unread_items = [
-            item for item in feed_items
-            if item.get("unread") or item.get("no_answer_followup")
-        ]
+        if item.get("unread") or item.get("no_answer_followup"):
+            found += 1
+            yield item
+    logger.info(f"Found {found} unread posts")
+
 
-        logger.info(f"Found {len(unread_items)} unread posts")
-        return unread_items
+def get_unread_posts(network, since: str | None = None, limit: int | None = 100) -> list:
+    """Get list of unread posts from the feed."""
+    try:
+        return list(iter_unread_posts(network, since=since, limit=limit))
     except Exception as e:
         logger.error(f"Error fetching unread posts: {e}")
         return []
 
 
+class FeedSnapshot:
+    """
+    Local snapshot of the feed: each post's last seen modification marker,
+    plus the full post fetched for that marker.
+
+    Lets the bot tell new or changed feed items from ones it has already
+    seen, and reuse an already fetched full post (e.g. when retrying a
+    failed generation) instead of calling get_full_post again.
+    """
+
+    def __init__(self):
+        self._markers = {}
+        self._posts = {}
+        self._lock = threading.Lock()
+
+    def changed(self, item: dict) -> bool:
+        """True if the item is new or its marker differs from the last one seen."""
+        with self._lock:
+            return self._markers.get(item.get("id")) != feed_item_marker(item)
+
+    def remember(self, item: dict) -> None:
+        """Record the item's current marker."""
+        with self._lock:
+            self._markers[item.get("id")] = feed_item_marker(item)
+
+    def marker(self, post_id: str) -> str | None:
+        """Return the last seen marker for a post, if any."""
+        with self._lock:
+            return self._markers.get(post_id)
+
+    def get_post(self, post_id: str, marker: str) -> dict | None:
+        """Return the cached full post if it was fetched at this marker."""
+        with self._lock:
+            cached = self._posts.get(post_id)
+        if cached and cached[0] == marker:
+            return cached[1]
+        return None
+
+    def store_post(self, post_id: str, marker: str, full_post: dict) -> None:
+        """Cache a fetched full post under the marker it was fetched at."""
+        with self._lock:
+            self._posts[post_id] = (marker, full_post)
+
+    def forget_post(self, post_id: str) -> None:
+        """Drop a cached full post that will not be needed again."""
+        with self._lock:
+            self._posts.pop(post_id, None)
+
+
+def feed_item_marker(item: dict) -> str:
+    """Return the feed item's modification marker (changes whenever the post does)."""
+    return item.get("modified") or item.get("updated") or ""
+
+
+def modified_after(item: dict, timestamp: str | None) -> bool:
+    """
+    True if the feed item was modified after `timestamp` (a naive UTC ISO-8601 string, as stored in post_state).
+
+    Unlike FeedSnapshot.changed, this survives a restart. Returns False when
+    either time is missing or unparseable.
+    """
+    marker = feed_item_marker(item)
+    if not marker or not timestamp:
+        return False
+    try:
+        modified = datetime.fromisoformat(marker.replace("Z", "+00:00"))
+        since = datetime.fromisoformat(timestamp)
+    except ValueError:
+        return False
+    if modified.tzinfo is not None:
+        modified = modified.astimezone(timezone.utc).replace(tzinfo=None)
+    return modified > since
+
+
+def feed_item_cursor(item: dict) -> tuple[str, int]:
+    """
+    Return a sortable (modified timestamp, post nr) position for a feed item.
+
+    Piazza timestamps are ISO-8601 strings, so they order correctly as text.
+    """
+    nr = item.get("nr")
+    return feed_item_marker(item), nr if isinstance(nr, int) else 0
+
+
 def get_full_post(network, post_id: str) -> dict:
     """Get the full post object including all children."""
     logger.info(f"Fetching full post {post_id}...")
     try:
-        post = network.get_post(post_id)
+        post = _call(network.get_post, post_id, retries=config.PIAZZA_MAX_RETRIES)
         return post
     except Exception as e:
         logger.error(f"Error fetching full post {post_id}: {e}")
@@ -123,7 +308,7 @@ def post_answer(network, full_post: dict, answer_text: str) -> bool:
     try:
         # Try to post as instructor answer first
         logger.info(f"Attempting to post instructor answer to post #{post_nr}...")
-        network.create_instructor_answer(full_post, answer_text, revision=0)
+        _call(network.create_instructor_answer, full_post, answer_text, revision=0)
         logger.info(f"Successfully posted instructor answer to post #{post_nr}")
         return True
     except Exception as e:
@@ -132,7 +317,7 @@ def post_answer(network, full_post: dict, answer_text: str) -> bool:
             logger.info(f"Instructor answer failed (permission), falling back to followup for post #{post_nr}...")
             try:
                 followup_text = f"(AI Bot - Generated Answer)\n\n{answer_text}"
-                network.create_followup(full_post, followup_text)
+                _call(network.create_followup, full_post, followup_text)
                 logger.info(f"Successfully posted followup to post #{post_nr}")
                 return True
             except Exception as fallback_e:
@@ -0,0 +1,152 @@
+# Piazza-Chimp Processing Pipeline
+# Staged worker pools connected by bounded queues
+
+import logging
+import queue
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Sentinel telling a worker that no more items will arrive
+_STOP = object()
+
+
+class Stage:
+    """
+    One pipeline stage: a function run by a pool of worker threads.
+
+    The function receives one item and returns the item to hand to the
+    next stage, or None to drop it. With batch_size > 1 the function
+    instead receives a list of whatever items are already waiting (up to
+    batch_size) and returns a list of outputs, with None for dropped items.
+    """
+
+    def __init__(self, name: str, func, workers: int = 1, batch_size: int = 1):
+        """
+        Initialize the stage.
+
+        Args:
+            name: Stage name (used in logs and thread names)
+            func: Callable taking one item (or a list when batching) and returning
+                an item or None (or a list of those when batching)
+            workers: Number of worker threads for this stage
+            batch_size: Maximum items handed to func at once (1 disables batching)
+        """
+        self.name = name
+        self.func = func
+        self.workers = max(1, workers)
+        self.batch_size = max(1, batch_size)
+
+
+class Pipeline:
+    """
+    Run items through a sequence of stages concurrently.
+
+    Every stage reads from its own bounded queue, so a slow stage applies
+    back-pressure to the stages before it instead of buffering everything.
+    """
+
+    def __init__(self, stages: list[Stage], queue_size: int = 8):
+        """
+        Initialize the pipeline.
+
+        Args:
+            stages: Stages in processing order
+            queue_size: Maximum items buffered in front of each stage
+        """
+        self.stages = stages
+        self.queue_size = queue_size
+
+    def run(self, items) -> list:
+        """
+        Push items through every stage and wait for the pipeline to drain.
+
+        Args:
+            items: Iterable of input items for the first stage (consumed lazily,
+                so a generator's items start flowing before it is exhausted)
+
+        Returns:
+            Items returned by the final stage, in completion order
+        """
+        queues = [queue.Queue(maxsize=self.queue_size) for _ in self.stages]
+        results = []
+        threads = []
+
+        for index, stage in enumerate(self.stages):
+            inbox = queues[index]
+            if index + 1 < len(self.stages):
+                outbox = queues[index + 1]
+                downstream_workers = self.stages[index + 1].workers
+            else:
+                outbox = None
+                downstream_workers = 0
+            state = {"alive": stage.workers, "lock": threading.Lock()}
+
+            for worker_num in range(stage.workers):
+                thread = threading.Thread(
+                    target=self._work,
+                    args=(stage, inbox, outbox, downstream_workers, state, results),
+                    name=f"{stage.name}-{worker_num}",
+                    daemon=True,
+                )
+                thread.start()
+                threads.append(thread)
+
+        # Items may come from a lazy generator; always release the workers
+        try:
+            for item in items:
+                queues[0].put(item)
+        finally:
+            for _ in range(self.stages[0].workers):
+                queues[0].put(_STOP)
+
+        for thread in threads:
+            thread.join()
+
+        return results
+
+    @staticmethod
+    def _work(stage: Stage, inbox: queue.Queue, outbox, downstream_workers: int, state: dict, results: list):
+        """Worker loop: apply the stage function until told to stop."""
+        stopping = False
+        while not stopping:
+            item = inbox.get()
+            if item is _STOP:
+                break
+            batch = [item]
+
+            # Take whatever else is already queued, without waiting for more
+            while len(batch) < stage.batch_size:
+                try:
+                    item = inbox.get_nowait()
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+
+            try:
+                if stage.batch_size > 1:
+                    outputs = stage.func(batch)
+                else:
+                    outputs = [stage.func(batch[0])]
+            except Exception as e:
+                logger.error(f"Error in {stage.name} stage: {e}", exc_info=True)
+                continue
+
+            for output in outputs:
+                if output is None:
+                    continue
+                if outbox is not None:
+                    outbox.put(output)
+                else:
+                    results.append(output)
+
+        # The last worker out closes the next stage
+        with state["lock"]:
+            state["alive"] -= 1
+            last_worker = state["alive"] == 0
+        if last_worker and outbox is not None:
+            for _ in range(downstream_workers):
+                outbox.put(_STOP)
@@ -0,0 +1,78 @@
+# Piazza-Chimp Poll Scheduler
+# Adaptive polling interval based on recent forum activity
+
+import logging
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+
+class PollScheduler:
+    """
+    Choose the sleep between poll cycles from recent activity.
+
+    A cycle that found new questions shrinks the interval (down to
+    min_interval); a quiet cycle grows it (up to max_interval). During
+    quiet hours the interval is at least quiet_interval.
+    """
+
+    def __init__(
+        self,
+        initial_interval: float,
+        min_interval: float,
+        max_interval: float,
+        busy_factor: float = 0.5,
+        idle_factor: float = 1.5,
+        quiet_hours: tuple[int, int] | None = None,
+        quiet_interval: float | None = None,
+    ):
+        """
+        Initialize the scheduler.
+
+        Args:
+            initial_interval: Interval before any activity has been seen, in seconds
+            min_interval: Shortest interval, in seconds
+            max_interval: Longest interval outside quiet hours, in seconds
+            busy_factor: Multiplier applied after a cycle with new questions (< 1)
+            idle_factor: Multiplier applied after a cycle without new questions (> 1)
+            quiet_hours: Optional (start_hour, end_hour) in local time; may wrap past midnight
+            quiet_interval: Minimum interval during quiet hours, in seconds
+        """
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.busy_factor = busy_factor
+        self.idle_factor = idle_factor
+        self.quiet_hours = quiet_hours
+        self.quiet_interval = quiet_interval
+        self.interval = min(max(initial_interval, min_interval), max_interval)
+
+    def in_quiet_hours(self, now: datetime) -> bool:
+        """True if `now` falls inside the configured quiet hours."""
+        if not self.quiet_hours:
+            return False
+        start, end = self.quiet_hours
+        if start <= end:
+            return start <= now.hour < end
+        return now.hour >= start or now.hour < end
+
+    def next_interval(self, new_questions: int, now: datetime | None = None) -> float:
+        """
+        Update the interval after a poll cycle and return how long to sleep.
+
+        Args:
+            new_questions: Number of new or changed questions the cycle found
+            now: Current local time (defaults to datetime.now())
+
+        Returns:
+            Seconds to sleep before the next cycle
+        """
+        now = now or datetime.now()
+
+        if new_questions > 0:
+            self.interval = max(self.min_interval, self.interval * self.busy_factor)
+        else:
+            self.interval = min(self.max_interval, self.interval * self.idle_factor)
+
+        if self.quiet_interval and self.in_quiet_hours(now):
+            return max(self.interval, self.quiet_interval)
+        return self.interval
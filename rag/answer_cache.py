@@ -0,0 +1,120 @@
+# RAG Answer Cache
+# Semantic cache of answered questions for reusing answers to near-duplicates
+
+import logging
+import time
+from . import embedder, vector_store
+
+logger = logging.getLogger(__name__)
+
+
+class AnswerCache:
+    """
+    Cache of answered questions, keyed by question embedding.
+
+    Each entry is one answered post: the question text is the document, its
+    embedding the vector, and the answer plus bookkeeping live in metadata.
+    A new question whose cosine distance to a cached one is at most
+    max_distance, and whose entry is younger than ttl_sec, is a hit.
+    """
+
+    def __init__(
+        self,
+        chroma_path: str,
+        collection_name: str,
+        embedding_model: str = embedder.DEFAULT_MODEL,
+        max_distance: float = 0.1,
+        ttl_sec: float = 14 * 24 * 3600,
+    ):
+        """
+        Initialize the cache.
+
+        Args:
+            chroma_path: Path to ChromaDB database
+            collection_name: Dedicated collection holding the cached answers
+            embedding_model: Name of embedding model used for the questions
+            max_distance: Largest cosine distance still counted as the same question
+            ttl_sec: Age in seconds after which an entry is no longer used
+
+        Raises:
+            ValueError: If the collection was built with a different embedding model
+        """
+        self.embedding_model = embedding_model
+        self.max_distance = max_distance
+        self.ttl_sec = ttl_sec
+        self.client = vector_store.init_store(chroma_path)
+        self.collection = vector_store.get_or_create_collection(
+            self.client, collection_name, embedding_model
+        )
+        logger.info("Answer cache initialized")
+
+    def lookup_many(self, query_embeddings: list[list[float]]) -> list[dict | None]:
+        """
+        Find a cached answer for each question embedding.
+
+        Args:
+            query_embeddings: Question embeddings (from rag.embedder, same model)
+
+        Returns:
+            One hit dict (keys: post_id, post_nr, question, answer, tokens, distance)
+            or None per embedding
+        """
+        if not query_embeddings:
+            return []
+
+        fresh = {"cached_at": {"$gte": time.time() - self.ttl_sec}}
+        results = vector_store.query_collection_many(self.collection, query_embeddings, top_k=1, where=fresh)
+
+        hits = []
+        for result in results:
+            if not result or result[0]["distance"] > self.max_distance:
+                hits.append(None)
+                continue
+            best = result[0]
+            metadata = best["metadata"]
+            hits.append({
+                "post_id": best["id"],
+                "post_nr": metadata.get("post_nr", "?"),
+                "question": best["text"],
+                "answer": metadata.get("answer", ""),
+                "tokens": metadata.get("tokens", 0),
+                "distance": best["distance"],
+            })
+        return hits
+
+    def add(self, post_id: str, post_nr: int, question: str, embedding: list[float],
+            answer: str, tokens: int = 0) -> None:
+        """
+        Cache the answer given to a post.
+
+        Args:
+            post_id: Piazza post ID (one entry per post)
+            post_nr: Post number, used to point students at the original thread
+            question: Question text the embedding was computed from
+            embedding: Question embedding
+            answer: Answer text as generated (without the disclaimer)
+            tokens: Tokens the generation cost, reported as saved on each hit
+        """
+        vector_store.upsert_chunks(
+            self.collection,
+            [{
+                "id": post_id,
+                "text": question,
+                "metadata": {
+                    "post_nr": post_nr,
+                    "answer": answer,
+                    "tokens": tokens,
+                    "cached_at": time.time(),
+                },
+            }],
+            embeddings=[embedding],
+        )
+
+    def prune(self) -> None:
+        """Delete entries older than the TTL."""
+        self.collection.delete(where={"cached_at": {"$lt": time.time() - self.ttl_sec}})
+
+
+def adapt_answer(hit: dict) -> str:
+    """Reuse a cached answer, pointing the student at the thread it came from."""
+    return f"A very similar question was answered in @{hit['post_nr']}:\n\n{hit['answer']}"
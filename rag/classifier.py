@@ -0,0 +1,109 @@
+# RAG Question Classifier
+# Cheap local triage of questions from their embeddings and retrieval distances
+
+import logging
+import math
+import threading
+from dataclasses import dataclass
+from . import embedder
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class Classification:
+    """
+    What the heuristic made of one question.
+
+    category is the closest prototype category; confidence is its similarity
+    margin over the runner-up (low means ambiguous). covered is True when a
+    retrieved chunk is close enough that answering is mostly a lookup.
+    """
+    category: str
+    confidence: float
+    covered: bool
+    long: bool
+
+
+class QuestionClassifier:
+    """
+    Nearest-prototype classifier over question embeddings.
+
+    Each category is described by a few example questions; a question
+    belongs to the category whose closest example it is most similar to.
+    Example embeddings are computed once, on first use.
+    """
+
+    def __init__(
+        self,
+        prototypes: dict[str, list[str]],
+        embedding_model: str = embedder.DEFAULT_MODEL,
+        covered_distance: float = 0.35,
+        long_question_words: int = 120,
+    ):
+        """
+        Initialize the classifier.
+
+        Args:
+            prototypes: {category: example questions}
+            embedding_model: Name of embedding model; must match the question embeddings
+            covered_distance: Largest RAG distance still counted as covering the question
+            long_question_words: Questions longer than this are flagged long
+        """
+        self.prototypes = prototypes
+        self.embedding_model = embedding_model
+        self.covered_distance = covered_distance
+        self.long_question_words = long_question_words
+        self._prototype_embeddings = None
+        self._lock = threading.Lock()
+
+    def _get_prototype_embeddings(self) -> dict[str, list[list[float]]]:
+        with self._lock:
+            if self._prototype_embeddings is None:
+                self._prototype_embeddings = {
+                    category: embedder.embed(examples, model_name=self.embedding_model)
+                    for category, examples in self.prototypes.items()
+                }
+            return self._prototype_embeddings
+
+    def classify_many(
+        self,
+        questions: list[str],
+        embeddings: list[list[float]],
+        rag_distances: list[list[float]],
+    ) -> list[Classification]:
+        """
+        Classify several questions.
+
+        Args:
+            questions: Question texts
+            embeddings: Embedding per question (same model as the prototypes)
+            rag_distances: Distances of the retrieved chunks, per question
+
+        Returns:
+            One Classification per question
+        """
+        prototype_embeddings = self._get_prototype_embeddings()
+        results = []
+        for question, embedding, distances in zip(questions, embeddings, rag_distances):
+            scores = sorted(
+                ((max(_cosine(embedding, example) for example in examples), category)
+                 for category, examples in prototype_embeddings.items() if examples),
+                reverse=True,
+            )
+            best_score, category = scores[0]
+            runner_up = scores[1][0] if len(scores) > 1 else -1.0
+            results.append(Classification(
+                category=category,
+                confidence=best_score - runner_up,
+                covered=bool(distances) and min(distances) <= self.covered_distance,
+                long=len(question.split()) > self.long_question_words,
+            ))
+        return results
+
+
+def _cosine(a: list[float], b: list[float]) -> float:
+    """Cosine similarity of two vectors."""
+    dot = sum(x * y for x, y in zip(a, b))
+    norm = math.sqrt(sum(x * x for x in a)) * math.sqrt(sum(y * y for y in b))
+    return dot / norm if norm else 0.0
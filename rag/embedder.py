@@ -1,50 +1,165 @@
 # RAG Embedder
 # Thin wrapper around sentence-transformers for text embeddings
 
+import hashlib
 import logging
+import sqlite3
+import threading
+from array import array
 from sentence_transformers import SentenceTransformer
 
 logger = logging.getLogger(__name__)
 
-# Load model once at import time
-_model = None
+DEFAULT_MODEL = "all-MiniLM-L6-v2"
 
+# Models are loaded once per name and shared by ingestion and queries
+_models = {}
+_models_lock = threading.Lock()
 
-def _get_model():
+# Optional on-disk cache of embeddings keyed by (model name, sha256 of text)
+_cache_conn = None
+_cache_lock = threading.Lock()
+_cache_stats = {"hits": 0, "misses": 0}
+
+# SQLite limits the number of bound parameters per statement
+_CACHE_LOOKUP_BATCH = 500
+
+
+def _get_model(model_name: str = DEFAULT_MODEL):
     """Lazy-load the embedding model."""
-    global _model
-    if _model is None:
-        logger.info("Loading embedding model: all-MiniLM-L6-v2")
-        _model = SentenceTransformer("all-MiniLM-L6-v2")
-    return _model
+    with _models_lock:
+        model = _models.get(model_name)
+        if model is None:
+            logger.info(f"Loading embedding model: {model_name}")
+            model = SentenceTransformer(model_name)
+            _models[model_name] = model
+        return model
 
 
-def embed(texts: list[str]) -> list[list[float]]:
+def enable_cache(path: str) -> None:
+    """
+    Open (creating if needed) the on-disk embedding cache.
+
+    Once enabled, embed() only encodes texts it has not seen before with
+    the same model, and reuses the stored vectors for the rest.
+
+    Args:
+        path: SQLite database file for the cache
+    """
+    global _cache_conn
+    conn = sqlite3.connect(path, check_same_thread=False)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS embeddings (
+            model TEXT NOT NULL,
+            text_hash TEXT NOT NULL,
+            vector BLOB NOT NULL,
+            PRIMARY KEY (model, text_hash)
+        )
+    """)
+    conn.commit()
+    with _cache_lock:
+        _cache_conn = conn
+    logger.info(f"Embedding cache enabled: {path}")
+
+
+def cache_stats() -> dict:
+    """Return embedding cache counters: {"hits": int, "misses": int}."""
+    with _cache_lock:
+        return dict(_cache_stats)
+
+
+def _text_hash(text: str) -> str:
+    """Hash a text for use as a cache key."""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def _cache_get(model_name: str, hashes: list[str]) -> dict:
+    """Look up cached vectors, returning {text_hash: vector} for the hits."""
+    found = {}
+    with _cache_lock:
+        for start in range(0, len(hashes), _CACHE_LOOKUP_BATCH):
+            batch = hashes[start:start + _CACHE_LOOKUP_BATCH]
+            placeholders = ",".join("?" * len(batch))
+            rows = _cache_conn.execute(
+                f"SELECT text_hash, vector FROM embeddings WHERE model = ? AND text_hash IN ({placeholders})",
+                [model_name, *batch],
+            )
+            for text_hash, blob in rows:
+                vector = array("f")
+                vector.frombytes(blob)
+                found[text_hash] = vector.tolist()
+    return found
+
+
+def _cache_put(model_name: str, items: dict) -> None:
+    """Store {text_hash: vector} in the cache as float32 blobs."""
+    with _cache_lock:
+        _cache_conn.executemany(
+            "INSERT OR REPLACE INTO embeddings (model, text_hash, vector) VALUES (?, ?, ?)",
+            [(model_name, text_hash, array("f", vector).tobytes()) for text_hash, vector in items.items()],
+        )
+        _cache_conn.commit()
+
+
+def _encode(texts: list[str], model_name: str, batch_size: int) -> list[list[float]]:
+    """Run the embedding model over texts."""
+    model = _get_model(model_name)
+    embeddings = model.encode(texts, batch_size=batch_size, convert_to_tensor=False)
+    return [emb.tolist() if hasattr(emb, 'tolist') else list(emb) for emb in embeddings]
+
+
+def embed(texts: list[str], model_name: str = DEFAULT_MODEL, batch_size: int = 64) -> list[list[float]]:
     """
     Embed a list of texts.
 
+    If the cache is enabled (see enable_cache), only cache misses are encoded.
+
     Args:
         texts: List of text strings to embed
+        model_name: sentence-transformers model to use
+        batch_size: Number of texts per encoder forward pass
 
     Returns:
         List of embedding vectors (each is a list of floats)
     """
-    model = _get_model()
-    embeddings = model.encode(texts, convert_to_tensor=False)
-    return [emb.tolist() if hasattr(emb, 'tolist') else list(emb) for emb in embeddings]
+    if not texts:
+        return []
+    if _cache_conn is None:
+        return _encode(texts, model_name, batch_size)
+
+    hashes = [_text_hash(text) for text in texts]
+    vectors = _cache_get(model_name, list(set(hashes)))
+
+    # Encode each distinct missing text once
+    missing = {}
+    for text_hash, text in zip(hashes, texts):
+        if text_hash not in vectors and text_hash not in missing:
+            missing[text_hash] = text
+    if missing:
+        encoded = _encode(list(missing.values()), model_name, batch_size)
+        new_vectors = dict(zip(missing.keys(), encoded))
+        _cache_put(model_name, new_vectors)
+        vectors.update(new_vectors)
+
+    with _cache_lock:
+        _cache_stats["misses"] += len(missing)
+        _cache_stats["hits"] += len(texts) - len(missing)
+
+    return [vectors[text_hash] for text_hash in hashes]
 
 
-def embed_one(text: str) -> list[float]:
+def embed_one(text: str, model_name: str = DEFAULT_MODEL) -> list[float]:
     """
     Embed a single text.
 
     Args:
         text: Text string to embed
+        model_name: sentence-transformers model to use
 
     Returns:
         Embedding vector (list of floats)
     """
-    model = _get_model()
+    model = _get_model(model_name)
     embedding = model.encode(text, convert_to_tensor=False)
     result = embedding.tolist() if hasattr(embedding, 'tolist') else list(embedding)
     return result
@@ -0,0 +1,94 @@
+# RAG Fusion
+# Strategies for merging ranked results from several collections into one ranking
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def reciprocal_rank_fusion(ranked_lists: dict[str, list], weights: dict[str, float] | None = None,
+                           k: int = 60) -> list[tuple[float, object]]:
+    """
+    Reciprocal rank fusion: an item ranked r in a list scores weight / (k + r).
+
+    Only ranks matter, so collections whose distances are on different
+    scales still mix fairly.
+
+    Args:
+        ranked_lists: {collection name: items, best first}
+        weights: Optional {collection name: weight} (default 1.0)
+        k: Damping constant; larger values flatten the gap between ranks
+
+    Returns:
+        (score, item) pairs, highest score first
+    """
+    weights = weights or {}
+    scored = []
+    for name, items in ranked_lists.items():
+        weight = weights.get(name, 1.0)
+        for rank, item in enumerate(items, start=1):
+            scored.append((weight / (k + rank), item))
+    return _sorted(scored)
+
+
+def min_max_fusion(ranked_lists: dict[str, list], weights: dict[str, float] | None = None,
+                   **_) -> list[tuple[float, object]]:
+    """
+    Score normalization: rescale each list's similarities (1 - distance) to 0..1, then weight.
+
+    The best item of every list scores its full weight, so no collection
+    dominates just because its distances run lower; but, as with RRF, a
+    collection's best hit ranks high however far it is. A list whose items
+    are all equally similar (such as a single hit) has no range to rescale,
+    so its items keep their raw similarity instead of a perfect 1.0.
+    """
+    weights = weights or {}
+    scored = []
+    for name, items in ranked_lists.items():
+        if not items:
+            continue
+        weight = weights.get(name, 1.0)
+        similarities = [1.0 - item.distance for item in items]
+        low, high = min(similarities), max(similarities)
+        for similarity, item in zip(similarities, items):
+            normalized = (similarity - low) / (high - low) if high > low else similarity
+            scored.append((weight * normalized, item))
+    return _sorted(scored)
+
+
+def distance_fusion(ranked_lists: dict[str, list], weights: dict[str, float] | None = None,
+                    **_) -> list[tuple[float, object]]:
+    """Raw similarity (1 - distance) times weight; fine when all collections share one embedding model."""
+    weights = weights or {}
+    scored = [
+        (weights.get(name, 1.0) * (1.0 - item.distance), item)
+        for name, items in ranked_lists.items()
+        for item in items
+    ]
+    return _sorted(scored)
+
+
+def _sorted(scored: list[tuple[float, object]]) -> list[tuple[float, object]]:
+    return sorted(scored, key=lambda pair: pair[0], reverse=True)
+
+
+FUSION_STRATEGIES = {
+    "rrf": reciprocal_rank_fusion,
+    "minmax": min_max_fusion,
+    "distance": distance_fusion,
+}
+
+
+def get_strategy(name: str):
+    """
+    Look up a fusion strategy by name.
+
+    Raises:
+        ValueError: If no strategy has that name
+    """
+    try:
+        return FUSION_STRATEGIES[name]
+    except KeyError:
+        raise ValueError(
+            f"Unknown fusion strategy {name!r}; choose one of {', '.join(FUSION_STRATEGIES)}"
+        ) from None
@@ -1,11 +1,16 @@
 # RAG Ingester
 # Document loading, chunking, and ingestion into ChromaDB
 
+import fnmatch
+import hashlib
 import logging
+import os
 import re
 from pathlib import Path
 from pypdf import PdfReader
 
+from . import embedder
+
 logger = logging.getLogger(__name__)
 
 
@@ -89,43 +94,115 @@ def chunk_text(text: str, chunk_size: int = 512, overlap: int = 64) -> list[str]
     return chunks
 
 
-def ingest_file(path: str, collection, source_label: str, chunk_size: int = 512, overlap: int = 64):
+def load_document(path: str) -> str:
     """
-    Ingest a file: load, chunk, and upsert to collection.
+    Load a document, choosing the loader by file extension.
 
     Args:
-        path: File path to ingest
-        collection: ChromaDB collection to upsert into
-        source_label: Label for metadata (e.g., filename)
-        chunk_size: Chunk size in words
-        overlap: Overlap in words
+        path: File path
 
     Returns:
-        Number of chunks ingested
+        Extracted text (may be empty)
     """
     path = Path(path)
-
-    # Load file based on extension
     if path.suffix.lower() == '.pdf':
-        text = load_pdf(str(path))
+        return load_pdf(str(path))
     elif path.suffix.lower() in ['.md', '.markdown']:
-        text = load_markdown(str(path))
+        return load_markdown(str(path))
     else:
-        text = load_text_file(str(path))
+        return load_text_file(str(path))
+
+
+def iter_files(root: str, extensions: list[str], include: list[str] | None = None, exclude: list[str] | None = None):
+    """
+    Recursively walk a directory, yielding matching files as they are found.
+
+    Patterns are fnmatch globs matched against the path relative to root
+    (with "/" separators), e.g. "week*/**" or "*.draft.md". Directories
+    matching an exclude pattern are not descended into.
+
+    Args:
+        root: Directory to walk
+        extensions: Lowercase file extensions to keep (e.g. [".pdf", ".md"])
+        include: If given, only files matching one of these patterns are yielded
+        exclude: Files and directories matching any of these patterns are skipped
+
+    Yields:
+        Path of each matching file, in sorted order within each directory
+    """
+    root = Path(root)
+    exclude = exclude or []
+
+    def excluded(rel_path: str) -> bool:
+        return any(fnmatch.fnmatch(rel_path, pattern) for pattern in exclude)
+
+    for dirpath, dirnames, filenames in os.walk(root):
+        rel_dir = Path(dirpath).relative_to(root)
+        dirnames[:] = sorted(d for d in dirnames if not excluded((rel_dir / d).as_posix()))
+
+        for filename in sorted(filenames):
+            rel_path = (rel_dir / filename).as_posix()
+            if Path(filename).suffix.lower() not in extensions or excluded(rel_path):
+                continue
+            if include and not any(fnmatch.fnmatch(rel_path, pattern) for pattern in include):
+                continue
+            yield Path(dirpath) / filename
+
+
+def file_hash(path: str) -> str:
+    """
+    Compute the sha256 of a file's contents.
+
+    Args:
+        path: File path
+
+    Returns:
+        Hex digest
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def build_chunks(
+    path: str,
+    source_label: str,
+    chunk_size: int = 512,
+    overlap: int = 64,
+    doc_id: str | None = None,
+) -> list[dict]:
+    """
+    Load and chunk a file into dicts ready for upsert.
+
+    Args:
+        path: File path to load
+        source_label: Label for metadata (e.g., filename)
+        chunk_size: Chunk size in words
+        overlap: Overlap in words
+        doc_id: Prefix for chunk ids, unique per document (default: file stem)
+
+    Returns:
+        List of dicts with keys: id, text, metadata (empty if no text was extracted)
+    """
+    path = Path(path)
+    text = load_document(str(path))
 
     if not text:
         logger.warning(f"No text extracted from {path}")
-        return 0
+        return []
 
     # Chunk text
     chunks = chunk_text(text, chunk_size=chunk_size, overlap=overlap)
     logger.info(f"Created {len(chunks)} chunks from {path}")
 
     # Prepare chunks for ingestion
+    doc_id = doc_id or path.stem
     chunk_dicts = []
     for idx, chunk in enumerate(chunks):
         chunk_dicts.append({
-            "id": f"{path.stem}_{idx}",
+            "id": f"{doc_id}_{idx}",
             "text": chunk,
             "metadata": {
                 "source": source_label,
@@ -133,10 +210,145 @@ def ingest_file(path: str, collection, source_label: str, chunk_size: int = 512,
                 "filename": path.name,
             }
         })
+    return chunk_dicts
+
+
+def prepare_file(
+    path: str,
+    source_label: str,
+    chunk_size: int = 512,
+    overlap: int = 64,
+    previous_hash: str | None = None,
+    doc_id: str | None = None,
+) -> dict:
+    """
+    Hash, load and chunk a file without touching the vector store.
+
+    Safe to run in a worker process: it only reads the file, and the
+    returned dict is picklable.
+
+    Args:
+        path: File path to prepare
+        source_label: Label for metadata (e.g., filename)
+        chunk_size: Chunk size in words
+        overlap: Overlap in words
+        previous_hash: Content hash from the last ingest, if any
+        doc_id: Prefix for chunk ids, unique per document (default: file stem)
+
+    Returns:
+        Dict with keys: path, content_hash, chunks. chunks is None when the
+        content hash equals previous_hash (file touched but not changed).
+    """
+    content_hash = file_hash(path)
+    if previous_hash is not None and content_hash == previous_hash:
+        return {"path": path, "content_hash": content_hash, "chunks": None}
+    chunks = build_chunks(path, source_label, chunk_size=chunk_size, overlap=overlap, doc_id=doc_id)
+    return {"path": path, "content_hash": content_hash, "chunks": chunks}
+
+
+class BatchUpserter:
+    """
+    Buffer chunks and embed + upsert them in large batches.
+
+    Callbacks passed to add() run once the chunks added with them have
+    been written, so callers can record progress only for data that is
+    actually in the store.
+    """
+
+    def __init__(self, collection, embedding_model: str = embedder.DEFAULT_MODEL, batch_size: int = 256):
+        """
+        Initialize the writer.
+
+        Args:
+            collection: ChromaDB collection to upsert into
+            embedding_model: sentence-transformers model used to embed the chunks
+            batch_size: Number of buffered chunks that triggers a flush
+        """
+        self.collection = collection
+        self.embedding_model = embedding_model
+        self.batch_size = batch_size
+        self.written = 0
+        self._chunks = []
+        self._callbacks = []
+
+    def add(self, chunks: list[dict], on_written=None) -> None:
+        """
+        Buffer chunks, flushing when the batch is full.
+
+        Args:
+            chunks: List of dicts with keys: id, text, metadata
+            on_written: Optional callable run after these chunks are upserted
+        """
+        self._chunks.extend(chunks)
+        if on_written is not None:
+            self._callbacks.append(on_written)
+        if len(self._chunks) >= self.batch_size:
+            self.flush()
+
+    @property
+    def pending(self) -> int:
+        """Number of callbacks waiting for their chunks to be written."""
+        return len(self._callbacks)
+
+    def flush(self) -> int:
+        """
+        Embed and upsert everything buffered, then run pending callbacks.
+
+        Returns:
+            Number of chunks written by this flush
+        """
+        # Import here to avoid circular dependency
+        from . import vector_store
+
+        num_upserted = 0
+        if self._chunks:
+            embeddings = embedder.embed(
+                [chunk["text"] for chunk in self._chunks], model_name=self.embedding_model
+            )
+            num_upserted = vector_store.upsert_chunks(self.collection, self._chunks, embeddings=embeddings)
+            self.written += num_upserted
+
+        callbacks = self._callbacks
+        self._chunks = []
+        self._callbacks = []
+        for callback in callbacks:
+            callback()
+        return num_upserted
+
+
+def ingest_file(
+    path: str,
+    collection,
+    source_label: str,
+    chunk_size: int = 512,
+    overlap: int = 64,
+    embedding_model: str = embedder.DEFAULT_MODEL,
+):
+    """
+    Ingest a file: load, chunk, embed, and upsert to collection.
+
+    Args:
+        path: File path to ingest
+        collection: ChromaDB collection to upsert into
+        source_label: Label for metadata (e.g., filename)
+        chunk_size: Chunk size in words
+        overlap: Overlap in words
+        embedding_model: sentence-transformers model used to embed the chunks
+
+    Returns:
+        Number of chunks ingested
+    """
+    path = Path(path)
+    chunk_dicts = build_chunks(str(path), source_label, chunk_size=chunk_size, overlap=overlap)
+    if not chunk_dicts:
+        return 0
+
+    # Embed with the same model the Retriever queries with
+    embeddings = embedder.embed([chunk["text"] for chunk in chunk_dicts], model_name=embedding_model)
 
     # Import here to avoid circular dependency
     from . import vector_store
-    num_upserted = vector_store.upsert_chunks(collection, chunk_dicts)
+    num_upserted = vector_store.upsert_chunks(collection, chunk_dicts, embeddings=embeddings)
     logger.info(f"Ingested {path.name}: {num_upserted} chunks")
 
     return num_upserted
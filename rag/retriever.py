@@ -2,81 +2,326 @@
 # Main query interface for retrieving relevant context
 
 import logging
-from . import embedder, vector_store
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from . import embedder, fusion, vector_store
 
 logger = logging.getLogger(__name__)
 
 
+@dataclass
+class ContextItem:
+    """One block of assembled context: a retrieved result, or adjacent chunks of one source merged."""
+    collection: str   # collection the result came from
+    kind: str         # "materials" or "piazza"; decides the label and whether chunks merge
+    label: str        # header line shown in the prompt
+    text: str
+    distance: float   # best (smallest) distance among the merged results
+    ids: list[str] = field(default_factory=list)
+    score: float = 0.0  # fused relevance score (higher is better)
+
+
+@dataclass
+class RetrievalResult:
+    """Context assembled for one question, with what went into it."""
+    text: str
+    items: list[ContextItem]
+    tokens: int = 0           # estimated tokens of text
+    dropped_far: int = 0      # results beyond the distance cutoff
+    dropped_budget: int = 0   # items that did not fit the token budget
+    merged: int = 0           # results folded into an adjacent chunk
+
+    @property
+    def scores(self) -> list[float]:
+        """Fused score of every item in the context, in context order."""
+        return [item.score for item in self.items]
+
+    @property
+    def distances(self) -> list[float]:
+        """Distance of every item in the context, in context order."""
+        return [item.distance for item in self.items]
+
+
+# Collections searched when none are configured: {name: {"kind", "weight"}}
+DEFAULT_COLLECTIONS = {
+    "course_materials": {"kind": "materials"},
+    "piazza_history": {"kind": "piazza"},
+}
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (about four characters per token for English text)."""
+    return len(text) // 4 + 1
+
+
 class Retriever:
     """
-    Retriever for querying course materials and Piazza history.
+    Retriever for querying course materials, Piazza history and any other
+    configured collections.
+
+    Collections are searched concurrently and their results merged into
+    one ranking by a fusion strategy (see rag.fusion).
     """
 
-    def __init__(self, chroma_path: str, embedding_model: str = "all-MiniLM-L6-v2"):
+    def __init__(
+        self,
+        chroma_path: str,
+        embedding_model: str = embedder.DEFAULT_MODEL,
+        max_distance: float | None = None,
+        token_budget: int | None = None,
+        collections: dict[str, dict] | None = None,
+        fusion_strategy: str = "distance",
+        rrf_k: int = 60,
+    ):
         """
         Initialize the retriever.
 
         Args:
             chroma_path: Path to ChromaDB database
-            embedding_model: Name of embedding model (currently unused, for future flexibility)
+            embedding_model: Name of embedding model; must match the model the
+                collections were ingested with
+            max_distance: Results farther than this are left out of the context
+            token_budget: Approximate maximum tokens of context per question
+            collections: {collection name: {"kind": "materials" or "piazza",
+                "weight": fusion weight (default 1.0)}}; defaults to DEFAULT_COLLECTIONS
+            fusion_strategy: Name of a strategy in rag.fusion.FUSION_STRATEGIES
+            rrf_k: Damping constant for reciprocal rank fusion
+
+        Raises:
+            ValueError: If no collection is configured, a collection was built with a
+                different embedding model, or the fusion strategy is unknown
         """
+        if collections is None:
+            collections = DEFAULT_COLLECTIONS
+        if not collections:
+            raise ValueError("No RAG collections configured; list at least one in RAG_COLLECTIONS")
+
+        self.embedding_model = embedding_model
+        self.max_distance = max_distance
+        self.token_budget = token_budget
+        self.fuse = fusion.get_strategy(fusion_strategy)
+        self.rrf_k = rrf_k
         self.client = vector_store.init_store(chroma_path)
-        self.materials_collection = vector_store.get_or_create_collection(
-            self.client, "course_materials"
-        )
-        self.piazza_collection = vector_store.get_or_create_collection(
-            self.client, "piazza_history"
-        )
-        logger.info("Retriever initialized")
 
-    def query(self, question: str, top_k: int = 5) -> str:
+        self.collections = {}
+        for name, spec in collections.items():
+            self.collections[name] = {
+                "collection": vector_store.get_or_create_collection(self.client, name, embedding_model),
+                "kind": spec.get("kind", "materials"),
+                "weight": spec.get("weight", 1.0),
+            }
+
+        # One thread per collection, kept for the retriever's lifetime
+        self._executor = ThreadPoolExecutor(max_workers=len(self.collections), thread_name_prefix="rag-query")
+        logger.info(f"Retriever initialized ({', '.join(self.collections)}; {fusion_strategy} fusion)")
+
+    def query(self, question: str, top_k: int = 5) -> RetrievalResult:
         """
-        Query both collections and return formatted context block.
+        Query every collection and assemble the context block.
 
         Args:
             question: The query question
             top_k: Number of top results to return from each collection
 
         Returns:
-            Formatted context string (may be empty if no results)
+            RetrievalResult; its text is the formatted context (may be empty if no results)
         """
-        # Embed the question
-        query_embedding = embedder.embed_one(question)
+        return self.query_many([question], top_k=top_k)[0]
 
-        # Query both collections
-        materials_results = vector_store.query_collection(
-            self.materials_collection, query_embedding, top_k=top_k
-        )
-        piazza_results = vector_store.query_collection(
-            self.piazza_collection, query_embedding, top_k=top_k
-        )
+    def query_many(
+        self, questions: list[str], top_k: int = 5, embeddings: list[list[float]] | None = None
+    ) -> list[RetrievalResult]:
+        """
+        Query every collection for several questions at once.
 
-        # Build formatted context block
-        context_lines = []
+        All questions are embedded in one batched encode, and each
+        collection is queried once with every query embedding.
+
+        Args:
+            questions: The query questions
+            top_k: Number of top results to return from each collection, per question
+            embeddings: Optional precomputed embedding per question (skips the encode)
+
+        Returns:
+            One RetrievalResult per question
+        """
+        return [
+            self.build_context(hits)
+            for hits in self.search_many(questions, top_k=top_k, embeddings=embeddings)
+        ]
+
+    def search_many(
+        self, questions: list[str], top_k: int = 5, embeddings: list[list[float]] | None = None
+    ) -> list[dict[str, list[dict]]]:
+        """
+        Run the raw collection searches for several questions at once.
+
+        Every collection is queried in parallel; a collection whose query
+        fails contributes no results.
+
+        Args:
+            questions: The query questions
+            top_k: Number of top results to return from each collection, per question
+            embeddings: Optional precomputed embedding per question, made with
+                self.embedding_model (skips the encode)
+
+        Returns:
+            One {collection name: results} dict per question, where each result
+            dict has keys: id, text, metadata, distance, collection, kind
+        """
+        if not questions:
+            return []
 
-        # Add materials
-        if materials_results:
-            for result in materials_results:
-                source = result["metadata"].get("source", "Unknown")
-                text = result["text"]
-                context_lines.append(f"[From course materials - {source}]")
-                context_lines.append(text)
-                context_lines.append("")
-
-        # Add Piazza Q&As
-        if piazza_results:
-            for result in piazza_results:
-                post_nr = result["metadata"].get("post_nr", "?")
-                text = result["text"]
-                context_lines.append(f"[From past Q&A - @{post_nr}]")
-                context_lines.append(text)
-                context_lines.append("")
+        # Embed every question in a single forward pass, unless the caller already has
+        if embeddings is None:
+            query_embeddings = embedder.embed(questions, model_name=self.embedding_model)
+        else:
+            query_embeddings = embeddings
+
+        futures = {
+            name: self._executor.submit(
+                vector_store.query_collection_many, spec["collection"], query_embeddings, top_k=top_k
+            )
+            for name, spec in self.collections.items()
+        }
+        per_collection = {}
+        for name, future in futures.items():
+            try:
+                per_collection[name] = future.result()
+            except Exception as e:
+                logger.warning(f"Error querying collection {name}: {e}")
+                per_collection[name] = [[] for _ in query_embeddings]
+            for results in per_collection[name]:
+                for result in results:
+                    result["collection"] = name
+                    result["kind"] = self.collections[name]["kind"]
 
+        return [
+            {name: per_collection[name][index] for name in self.collections}
+            for index in range(len(query_embeddings))
+        ]
+
+    def build_context(self, hits: dict[str, list[dict]]) -> RetrievalResult:
+        """
+        Assemble the context block for one question from raw search results.
+
+        Results beyond max_distance are dropped, adjacent chunks of the same
+        material are merged into one passage, the collections' results are
+        fused into one ranking, and items are packed in that order until
+        token_budget is reached.
+
+        Args:
+            hits: {collection name: results}, as returned by search_many
+        """
+        ranked_lists = {}
+        dropped_far = 0
+        merged = 0
+        for name, results in hits.items():
+            near = [r for r in results if self._near(r)]
+            dropped_far += len(results) - len(near)
+            if self.collections[name]["kind"] == "materials":
+                items = _merge_adjacent_chunks(name, near)
+                merged += len(near) - len(items)
+            else:
+                items = [ContextItem(
+                    collection=name,
+                    kind="piazza",
+                    label=f"[From past Q&A - @{result['metadata'].get('post_nr', '?')}]",
+                    text=result["text"],
+                    distance=result["distance"],
+                    ids=[result["id"]],
+                ) for result in near]
+            ranked_lists[name] = sorted(items, key=lambda item: item.distance)
+
+        weights = {name: spec["weight"] for name, spec in self.collections.items()}
+        ranking = self.fuse(ranked_lists, weights, k=self.rrf_k)
+
+        # Best fused score first, until the budget is spent
+        packed = []
+        used = 0
+        dropped_budget = 0
+        for score, item in ranking:
+            item.score = score
+            cost = estimate_tokens(item.label) + estimate_tokens(item.text)
+            if self.token_budget is not None and used + cost > self.token_budget:
+                if packed:
+                    dropped_budget += 1
+                    continue
+                # Even the best item is too long: keep as much of it as fits
+                item.text = " ".join(item.text.split()[:max(1, (self.token_budget * 3) // 4)])
+                cost = estimate_tokens(item.label) + estimate_tokens(item.text)
+            packed.append(item)
+            used += cost
+
+        context_lines = []
+        for item in packed:
+            context_lines.append(item.label)
+            context_lines.append(item.text)
+            context_lines.append("")
         context_block = "\n".join(context_lines).strip()
 
+        result = RetrievalResult(
+            text=context_block,
+            items=packed,
+            tokens=estimate_tokens(context_block) if context_block else 0,
+            dropped_far=dropped_far,
+            dropped_budget=dropped_budget,
+            merged=merged,
+        )
+
         if context_block:
-            logger.info(f"Retrieved {len(materials_results)} material chunks and {len(piazza_results)} Q&A pairs")
+            materials_count = sum(1 for item in packed if item.kind == "materials")
+            logger.info(
+                f"Retrieved {materials_count} material passages and {len(packed) - materials_count} Q&A pairs "
+                f"(~{result.tokens} tokens; {dropped_far} too far, {merged} merged, {dropped_budget} over budget)"
+            )
         else:
             logger.info("No relevant context found in RAG collections")
 
-        return context_block
+        return result
+
+    def _near(self, result: dict) -> bool:
+        return self.max_distance is None or result["distance"] <= self.max_distance
+
+
+def _merge_adjacent_chunks(collection: str, results: list[dict]) -> list[ContextItem]:
+    """Merge material chunks with consecutive chunk indexes from the same source into single items."""
+    by_source = {}
+    for result in results:
+        by_source.setdefault(result["metadata"].get("source", "Unknown"), []).append(result)
+
+    items = []
+    for source, source_results in by_source.items():
+        source_results.sort(key=lambda r: r["metadata"].get("chunk_index", 0))
+        run = [source_results[0]]
+        for result in source_results[1:]:
+            previous_index = run[-1]["metadata"].get("chunk_index")
+            index = result["metadata"].get("chunk_index")
+            if previous_index is not None and index == previous_index + 1:
+                run.append(result)
+            else:
+                items.append(_merge_run(collection, source, run))
+                run = [result]
+        items.append(_merge_run(collection, source, run))
+    return items
+
+
+def _merge_run(collection: str, source: str, run: list[dict]) -> ContextItem:
+    """Join a run of consecutive chunks, dropping the words each repeats from the one before."""
+    words = run[0]["text"].split()
+    for result in run[1:]:
+        next_words = result["text"].split()
+        overlap = 0
+        for size in range(min(len(words), len(next_words)), 0, -1):
+            if words[-size:] == next_words[:size]:
+                overlap = size
+                break
+        words.extend(next_words[overlap:])
+    return ContextItem(
+        collection=collection,
+        kind="materials",
+        label=f"[From course materials - {source}]",
+        text=" ".join(words) if len(run) > 1 else run[0]["text"],
+        distance=min(r["distance"] for r in run),
+        ids=[r["id"] for r in run],
+    )
@@ -22,32 +22,64 @@ def init_store(path: str) -> chromadb.PersistentClient:
     return client
 
 
-def get_or_create_collection(client: chromadb.Client, name: str):
+def get_or_create_collection(client: chromadb.Client, name: str, embedding_model: str | None = None):
     """
     Get or create a collection by name.
 
+    When embedding_model is given it is recorded in the metadata of a new
+    collection, and an existing collection built with a different model is
+    rejected, since its vectors are not comparable with the new ones.
+
     Args:
         client: ChromaDB Client
         name: Collection name
+        embedding_model: Name of the model that embeds this collection's documents
 
     Returns:
         ChromaDB Collection
+
+    Raises:
+        ValueError: If the collection was built with a different embedding model
     """
     logger.info(f"Getting or creating collection: {name}")
-    collection = client.get_or_create_collection(
-        name=name,
-        metadata={"hnsw:space": "cosine"}
-    )
+    # Look the collection up first: some Chroma versions apply the metadata given to
+    # get_or_create_collection to an existing collection, replacing its recorded model
+    try:
+        collection = client.get_collection(name=name)
+    except Exception:
+        metadata = {"hnsw:space": "cosine"}
+        if embedding_model:
+            metadata["embedding_model"] = embedding_model
+        return client.get_or_create_collection(
+            name=name,
+            metadata=metadata
+        )
+
+    if embedding_model:
+        stored_model = (collection.metadata or {}).get("embedding_model")
+        if stored_model is None:
+            logger.warning(
+                f"Collection {name} does not record its embedding model; "
+                f"re-ingest it if it was not built with {embedding_model}"
+            )
+        elif stored_model != embedding_model:
+            raise ValueError(
+                f"Collection {name} was embedded with {stored_model} but {embedding_model} is configured; "
+                f"re-ingest the collection or set EMBEDDING_MODEL = {stored_model!r}"
+            )
+
     return collection
 
 
-def upsert_chunks(collection, chunks: list[dict]) -> int:
+def upsert_chunks(collection, chunks: list[dict], embeddings: list[list[float]] | None = None) -> int:
     """
     Upsert (insert or update) document chunks into a collection.
 
     Args:
         collection: ChromaDB Collection
         chunks: List of dicts with keys: id, text, metadata
+        embeddings: Precomputed embedding per chunk (from rag.embedder). If omitted,
+            Chroma falls back to its built-in embedding function.
 
     Returns:
         Number of chunks upserted
@@ -59,15 +91,35 @@ def upsert_chunks(collection, chunks: list[dict]) -> int:
     documents = [chunk["text"] for chunk in chunks]
     metadatas = [chunk["metadata"] for chunk in chunks]
 
-    collection.upsert(
-        ids=ids,
-        documents=documents,
-        metadatas=metadatas,
-    )
+    if embeddings is not None:
+        collection.upsert(
+            ids=ids,
+            documents=documents,
+            metadatas=metadatas,
+            embeddings=embeddings,
+        )
+    else:
+        collection.upsert(
+            ids=ids,
+            documents=documents,
+            metadatas=metadatas,
+        )
     logger.info(f"Upserted {len(chunks)} chunks to {collection.name}")
     return len(chunks)
 
 
+def delete_source(collection, source: str) -> None:
+    """
+    Delete every chunk whose metadata "source" matches.
+
+    Args:
+        collection: ChromaDB Collection
+        source: Source label the chunks were ingested with
+    """
+    collection.delete(where={"source": source})
+    logger.info(f"Deleted chunks for {source} from {collection.name}")
+
+
 def query_collection(collection, query_embedding: list[float], top_k: int = 5) -> list[dict]:
     """
     Query a collection by embedding vector.
@@ -80,21 +132,47 @@ def query_collection(collection, query_embedding: list[float], top_k: int = 5) -
     Returns:
         List of result dicts with keys: id, text, metadata, distance
     """
+    return query_collection_many(collection, [query_embedding], top_k=top_k)[0]
+
+
+def query_collection_many(
+    collection, query_embeddings: list[list[float]], top_k: int = 5, where: dict | None = None
+) -> list[list[dict]]:
+    """
+    Query a collection with several embedding vectors in one call.
+
+    Args:
+        collection: ChromaDB Collection
+        query_embeddings: List of embedding vectors
+        top_k: Number of results to return per query
+        where: Optional Chroma metadata filter applied to every query
+
+    Returns:
+        One list of result dicts (keys: id, text, metadata, distance) per query embedding
+    """
+    if not query_embeddings:
+        return []
+
+    kwargs = {"where": where} if where else {}
     results = collection.query(
-        query_embeddings=[query_embedding],
+        query_embeddings=query_embeddings,
         n_results=top_k,
-        include=["documents", "metadatas", "distances"]
+        include=["documents", "metadatas", "distances"],
+        **kwargs
     )
 
-    # Flatten results into a list of dicts
-    output = []
-    if results["ids"] and len(results["ids"]) > 0:
-        for i, doc_id in enumerate(results["ids"][0]):
-            output.append({
-                "id": doc_id,
-                "text": results["documents"][0][i],
-                "metadata": results["metadatas"][0][i],
-                "distance": results["distances"][0][i],
-            })
-
-    return output
+    # Flatten results into a list of dicts per query
+    outputs = []
+    for q in range(len(query_embeddings)):
+        output = []
+        if results["ids"] and len(results["ids"]) > q:
+            for i, doc_id in enumerate(results["ids"][q]):
+                output.append({
+                    "id": doc_id,
+                    "text": results["documents"][q][i],
+                    "metadata": results["metadatas"][q][i],
+                    "distance": results["distances"][q][i],
+                })
+        outputs.append(output)
+
+    return outputs
@@ -0,0 +1,181 @@
+# Piazza-Chimp Rate Limiting
+# Token buckets per backend, exponential backoff, and rate-limit header parsing
+
+import asyncio
+import threading
+import time
+from datetime import datetime, timezone
+
+import config
+
+
+class TokenBucket:
+    """
+    Token bucket rate limiter.
+
+    Tokens refill continuously at `rate` per second up to `capacity`.
+    acquire() blocks until a token is available, so any number of threads
+    can share one bucket and together stay under the backend's rate.
+    pause() holds every caller back, e.g. after the backend says "slow down".
+    """
+
+    def __init__(self, rate: float, capacity: float = 1.0):
+        """
+        Initialize the bucket.
+
+        Args:
+            rate: Tokens added per second
+            capacity: Maximum tokens held (burst size)
+        """
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._last = time.monotonic()
+        self._blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    def _reserve(self) -> float:
+        """Take one token and return how long the caller must wait for it."""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            # Going negative reserves a future token, so waiters queue up in order
+            self._tokens -= 1
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+            return max(wait, self._blocked_until - now)
+
+    def acquire(self) -> None:
+        """Block until a token is available."""
+        wait = self._reserve()
+        if wait > 0:
+            time.sleep(wait)
+
+    async def acquire_async(self) -> None:
+        """Wait (without blocking the event loop) until a token is available."""
+        wait = self._reserve()
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def pause(self, seconds: float) -> None:
+        """Hold back all callers for at least `seconds` from now."""
+        with self._lock:
+            self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+
+    def set_rate(self, rate: float) -> None:
+        """Change the refill rate, e.g. once the backend reports its real limit."""
+        if rate <= 0:
+            return
+        with self._lock:
+            self.rate = rate
+
+
+class Backoff:
+    """
+    Exponential backoff tracker.
+
+    Each consecutive failure doubles the delay (capped at `maximum`);
+    a success resets it.
+    """
+
+    def __init__(self, base: float, maximum: float):
+        """
+        Initialize the tracker.
+
+        Args:
+            base: Delay after the first failure, in seconds
+            maximum: Upper bound on the delay, in seconds
+        """
+        self.base = base
+        self.maximum = maximum
+        self._failures = 0
+        self._lock = threading.Lock()
+
+    def failure(self) -> float:
+        """Record a failure and return the delay to apply before the next call."""
+        with self._lock:
+            delay = min(self.maximum, self.base * (2 ** self._failures))
+            self._failures += 1
+            return delay
+
+    def success(self) -> None:
+        """Record a success, resetting the delay."""
+        with self._lock:
+            self._failures = 0
+
+
+_buckets = {}
+_backoffs = {}
+_registry_lock = threading.Lock()
+
+
+def get_bucket(backend: str) -> TokenBucket:
+    """Return the process-wide token bucket for a backend ("piazza" or "anthropic")."""
+    with _registry_lock:
+        bucket = _buckets.get(backend)
+        if bucket is None:
+            rate, capacity = config.RATE_LIMITS[backend]
+            bucket = TokenBucket(rate=rate, capacity=capacity)
+            _buckets[backend] = bucket
+        return bucket
+
+
+def get_backoff(backend: str) -> Backoff:
+    """Return the process-wide backoff tracker for a backend."""
+    with _registry_lock:
+        backoff = _backoffs.get(backend)
+        if backoff is None:
+            backoff = Backoff(base=config.BACKOFF_BASE_SEC, maximum=config.BACKOFF_MAX_SEC)
+            _backoffs[backend] = backoff
+        return backoff
+
+
+def retry_delay_from_headers(headers) -> float | None:
+    """
+    Work out how long to hold off from Anthropic rate-limit response headers.
+
+    Honors `retry-after`, and otherwise any exhausted
+    `anthropic-ratelimit-*-remaining` counter together with its reset time.
+
+    Args:
+        headers: Response headers (case-insensitive mapping), or None
+
+    Returns:
+        Seconds to wait, or None if the headers don't call for a wait
+    """
+    if not headers:
+        return None
+
+    retry_after = headers.get("retry-after")
+    if retry_after:
+        try:
+            return max(0.0, float(retry_after))
+        except ValueError:
+            pass
+
+    delays = []
+    for kind in ("requests", "tokens", "input-tokens", "output-tokens"):
+        remaining = headers.get(f"anthropic-ratelimit-{kind}-remaining")
+        reset = headers.get(f"anthropic-ratelimit-{kind}-reset")
+        if remaining is None or not reset or remaining.strip() != "0":
+            continue
+        try:
+            reset_at = datetime.fromisoformat(reset.replace("Z", "+00:00"))
+        except ValueError:
+            continue
+        delays.append((reset_at - datetime.now(timezone.utc)).total_seconds())
+
+    if not delays:
+        return None
+    return max(0.0, max(delays))
+
+
+def requests_per_second_from_headers(headers) -> float | None:
+    """Return the request rate allowed by `anthropic-ratelimit-requests-limit` (per minute), if present."""
+    if not headers:
+        return None
+    limit = headers.get("anthropic-ratelimit-requests-limit")
+    try:
+        return float(limit) / 60.0 if limit else None
+    except ValueError:
+        return None
@@ -0,0 +1,50 @@
+# Word budget and policy guards, with the configured policy patterns
+
+import answer_guard
+import config
+
+
+def guard(max_words=50):
+    return answer_guard.AnswerGuard(max_words, config.ANSWER_POLICY_PATTERNS)
+
+
+def test_mentioning_the_answer_key_is_allowed():
+    result = answer_guard.check_answer(
+        "The answer key will be posted on the course page after the deadline.", 50, config.ANSWER_POLICY_PATTERNS
+    )
+
+    assert result.tripped is None
+    assert not result.rejected
+
+
+def test_leaking_the_answer_key_is_rejected():
+    result = answer_guard.check_answer(
+        "Sure! Here is the answer key: 1. B 2. D", 50, config.ANSWER_POLICY_PATTERNS
+    )
+
+    assert result.rejected
+    assert result.tripped == "answer_key"
+
+
+def test_policy_phrase_split_across_streamed_chunks_is_caught():
+    g = guard()
+
+    assert not g.feed("Great question. Below is the complete ")
+    assert g.feed("solution to part (b):")
+    assert g.rejected
+    assert g.tripped == "full_solution"
+
+
+def test_word_budget_trims_instead_of_rejecting():
+    g = guard(max_words=10)
+
+    assert not g.feed("One two three four five six seven. ")
+    assert g.feed("Eight nine ten eleven twelve.")
+    assert g.truncated
+    assert not g.rejected
+    # Cut back to the last full sentence within the budget
+    assert g.text == "One two three four five six seven."
+
+
+def test_trim_to_words_keeps_short_text():
+    assert answer_guard.trim_to_words("Short answer.", 10) == "Short answer."
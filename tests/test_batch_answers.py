@@ -0,0 +1,202 @@
+# Batch mode against a local fake of the Message Batches endpoint
+
+import sys
+from types import SimpleNamespace
+
+import pytest
+
+import ai_answerer
+import batch_answers
+import config
+import db
+
+
+class FakeBatches:
+    """Stands in for client.messages.batches: records submissions and replays canned results."""
+
+    def __init__(self, statuses=("ended",), entries=()):
+        self.created = []
+        self.retrieved = 0
+        self.statuses = list(statuses)
+        self.entries = list(entries)
+
+    def create(self, requests):
+        self.created.append(requests)
+        return SimpleNamespace(id="msgbatch_test")
+
+    def retrieve(self, batch_id):
+        self.retrieved += 1
+        status = self.statuses.pop(0) if len(self.statuses) > 1 else self.statuses[0]
+        counts = SimpleNamespace(processing=1, succeeded=0, errored=0)
+        return SimpleNamespace(id=batch_id, processing_status=status, request_counts=counts)
+
+    def results(self, batch_id):
+        return iter(self.entries)
+
+
+def succeeded(custom_id, text):
+    message = SimpleNamespace(
+        content=[SimpleNamespace(text=text)],
+        model="claude-test",
+        usage=SimpleNamespace(input_tokens=100, output_tokens=20),
+    )
+    return SimpleNamespace(custom_id=custom_id, result=SimpleNamespace(type="succeeded", message=message))
+
+
+def errored(custom_id):
+    error = SimpleNamespace(type="invalid_request_error", message="bad request")
+    return SimpleNamespace(custom_id=custom_id, result=SimpleNamespace(type="errored", error=error))
+
+
+def expired(custom_id):
+    return SimpleNamespace(custom_id=custom_id, result=SimpleNamespace(type="expired"))
+
+
+class FakeRetriever:
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def query_many(self, questions, top_k=5):
+        return [SimpleNamespace(text=f"context for {question}") for question in questions]
+
+
+@pytest.fixture
+def batches(monkeypatch):
+    fake = FakeBatches()
+    client = SimpleNamespace(messages=SimpleNamespace(batches=fake))
+    monkeypatch.setattr(ai_answerer, "get_client", lambda api_key: client)
+    monkeypatch.setattr(ai_answerer.time, "sleep", lambda seconds: None)
+    return fake
+
+
+@pytest.fixture
+def conn(tmp_path):
+    conn = db.init_db(str(tmp_path / "bot.db"))
+    yield conn
+    conn.close()
+
+
+def question(post_id, post_nr):
+    return {"post_id": post_id, "post_nr": post_nr, "subject": f"subject {post_nr}", "content": f"content {post_nr}"}
+
+
+def save_batched(conn, *post_ids):
+    db.save_post_states(conn, [
+        {"post_id": post_id, "post_nr": nr, "status": db.STATUS_BATCHED, "attempts": 0}
+        for nr, post_id in enumerate(post_ids, start=1)
+    ])
+
+
+def test_collect_questions_leaves_drafted_and_in_flight_posts_alone(monkeypatch, conn):
+    feed = [{"id": post_id, "nr": nr} for nr, post_id in enumerate(["drafted", "pending", "generating", "new"], 1)]
+    monkeypatch.setattr(batch_answers.piazza_client, "iter_unread_posts", lambda network: iter(feed))
+    fetched = []
+
+    def get_full_post(network, post_id):
+        fetched.append(post_id)
+        return {"history": [{"subject": post_id, "content": f"question {post_id}"}]}
+    monkeypatch.setattr(batch_answers.piazza_client, "get_full_post", get_full_post)
+    monkeypatch.setattr(batch_answers.piazza_client, "should_answer", lambda full_post: True)
+    post_states = {
+        "drafted": {"status": db.STATUS_DRAFTED, "attempts": 0, "draft": "Already drafted."},
+        "pending": {"status": db.STATUS_PENDING, "attempts": 0},
+        "generating": {"status": db.STATUS_GENERATING, "attempts": 0},
+    }
+
+    questions = batch_answers.collect_questions(None, conn, post_states, limit=10, workers=2)
+
+    assert [q["post_id"] for q in questions] == ["new"]
+    assert fetched == ["new"]
+
+
+def test_submit_sends_one_request_per_question_and_marks_posts_batched(monkeypatch, batches, conn):
+    monkeypatch.setattr(batch_answers, "Retriever", FakeRetriever)
+
+    batch_id = batch_answers.submit(conn, [question("p1", 1), question("p2", 2)], "key", "CS1")
+
+    assert batch_id == "msgbatch_test"
+    assert db.get_sync_state(conn, batch_answers.BATCH_ID_KEY) == "msgbatch_test"
+    [requests] = batches.created
+    assert [request["custom_id"] for request in requests] == ["p1", "p2"]
+    assert "context for subject 1 content 1" in str(requests[0]["params"]["system"])
+    states = db.load_post_states(conn)
+    assert {state["status"] for state in states.values()} == {db.STATUS_BATCHED}
+    assert all(state["next_retry_at"] for state in states.values())
+
+
+def test_submit_without_rag_context(monkeypatch, batches, conn):
+    def unavailable(*args, **kwargs):
+        raise RuntimeError("no store")
+    monkeypatch.setattr(batch_answers, "Retriever", unavailable)
+
+    batch_answers.submit(conn, [question("p1", 1)], "key", "CS1")
+
+    assert len(batches.created[0]) == 1
+    assert db.load_post_states(conn)["p1"]["status"] == db.STATUS_BATCHED
+
+
+def test_store_results_drafts_successes_and_fails_the_rest(batches, conn):
+    save_batched(conn, "ok", "err", "exp", "policy", "done")
+    db.mark_answered(conn, "done", 5)
+    db.set_sync_state(conn, batch_answers.BATCH_ID_KEY, "msgbatch_test")
+    batches.entries = [
+        succeeded("ok", "Check the syllabus."),
+        errored("err"),
+        expired("exp"),
+        succeeded("policy", "Here is the answer key for the midterm."),
+        succeeded("done", "Too late."),
+    ]
+
+    counts = batch_answers.store_results(conn, "msgbatch_test", "key")
+
+    states = db.load_post_states(conn)
+    assert states["ok"]["status"] == db.STATUS_DRAFTED
+    assert states["ok"]["draft"] == "Check the syllabus."
+    for post_id in ("err", "exp"):
+        assert states[post_id]["status"] == db.STATUS_FAILED
+        assert states[post_id]["attempts"] == 1
+        assert states[post_id]["next_retry_at"]
+    assert "errored" in states["err"]["last_error"]
+    assert "expired" in states["exp"]["last_error"]
+    # A policy rejection is not retried: the same question would be rejected again
+    assert states["policy"]["status"] == db.STATUS_SKIPPED
+    assert states["policy"]["last_error"] == "answer rejected by answer_key guard"
+    assert states["done"]["status"] == db.STATUS_ANSWERED
+    assert counts == {"drafted": 1, "failed": 2, "rejected": 1, "input_tokens": 200, "output_tokens": 40}
+    assert not db.get_sync_state(conn, batch_answers.BATCH_ID_KEY)
+
+
+def test_store_results_trims_long_drafts(batches, conn):
+    save_batched(conn, "long")
+    batches.entries = [succeeded("long", "word " * (config.ANSWER_MAX_WORDS + 50))]
+
+    batch_answers.store_results(conn, "msgbatch_test", "key")
+
+    draft = db.load_post_states(conn)["long"]["draft"]
+    assert len(draft.split()) <= config.ANSWER_MAX_WORDS + 1
+
+
+def test_main_resumes_a_submitted_batch(monkeypatch, batches, tmp_path):
+    db_path = str(tmp_path / "bot.db")
+    conn = db.init_db(db_path)
+    save_batched(conn, "p1")
+    db.set_sync_state(conn, batch_answers.BATCH_ID_KEY, "msgbatch_test")
+    conn.close()
+
+    def no_login(*args, **kwargs):
+        raise AssertionError("a stored batch must be collected without logging in to Piazza")
+    monkeypatch.setattr(batch_answers.piazza_client, "login", no_login)
+    monkeypatch.setattr(config, "DB_PATH", db_path)
+    monkeypatch.setenv("ANTHROPIC_API_KEY", "key")
+    monkeypatch.setattr(sys, "argv", ["batch_answers.py", "--poll", "0"])
+    batches.statuses = ["in_progress", "ended"]
+    batches.entries = [succeeded("p1", "Office hours are on Monday.")]
+
+    batch_answers.main()
+
+    assert batches.created == []
+    assert batches.retrieved == 2
+    conn = db.init_db(db_path)
+    assert db.load_post_states(conn)["p1"]["status"] == db.STATUS_DRAFTED
+    assert not db.get_sync_state(conn, batch_answers.BATCH_ID_KEY)
+    conn.close()
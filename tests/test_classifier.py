@@ -0,0 +1,70 @@
+# Nearest-prototype question classifier, with hand-made embeddings
+
+import pytest
+
+from rag import classifier as classifier_module
+from rag import embedder
+from rag.classifier import QuestionClassifier
+
+EMBEDDINGS = {
+    "When is the exam?": [1.0, 0.0, 0.0],
+    "Where are office hours?": [0.9, 0.1, 0.0],
+    "Why does recursion terminate?": [0.0, 1.0, 0.0],
+}
+
+
+@pytest.fixture
+def embed_calls(monkeypatch):
+    calls = []
+
+    def embed(texts, model_name=None):
+        calls.append(list(texts))
+        return [EMBEDDINGS[text] for text in texts]
+    monkeypatch.setattr(embedder, "embed", embed)
+    return calls
+
+
+def make_classifier(**kwargs):
+    return QuestionClassifier({
+        "logistics": ["When is the exam?", "Where are office hours?"],
+        "conceptual": ["Why does recursion terminate?"],
+        "empty": [],
+    }, **kwargs)
+
+
+def test_nearest_example_decides_the_category(embed_calls):
+    [logistics, conceptual, ambiguous] = make_classifier().classify_many(
+        ["exam date?", "base case?", "both?"],
+        [[0.95, 0.05, 0.0], [0.1, 1.0, 0.0], [1.0, 1.0, 0.0]],
+        [[], [], []],
+    )
+
+    assert logistics.category == "logistics"
+    assert logistics.confidence > 0.5
+    assert conceptual.category == "conceptual"
+    assert ambiguous.confidence < 0.1
+
+
+def test_coverage_and_length_flags(embed_calls):
+    question = " ".join(["word"] * 11)
+
+    [near, far] = make_classifier(covered_distance=0.3, long_question_words=10).classify_many(
+        [question, "short"], [[1.0, 0.0, 0.0]] * 2, [[0.6, 0.25], [0.4]],
+    )
+
+    assert (near.covered, near.long) == (True, True)
+    assert (far.covered, far.long) == (False, False)
+
+
+def test_prototypes_are_embedded_once(embed_calls):
+    classifier = make_classifier()
+
+    for _ in range(3):
+        classifier.classify_many(["q"], [[1.0, 0.0, 0.0]], [[]])
+
+    assert len(embed_calls) == 3  # one call per category, on first use only
+
+
+def test_cosine_of_a_zero_vector_is_zero():
+    assert classifier_module._cosine([0.0, 0.0], [1.0, 0.0]) == 0.0
+    assert classifier_module._cosine([1.0, 1.0], [2.0, 2.0]) == pytest.approx(1.0)
@@ -0,0 +1,123 @@
+# Post state, ingest manifest and schema migrations in db.py
+
+import sqlite3
+from datetime import datetime, timedelta
+
+import db
+
+NOW = datetime(2026, 3, 2, 12, 0)
+
+
+def legacy_db(path, *statements):
+    conn = sqlite3.connect(path)
+    for statement in statements:
+        conn.execute(statement)
+    conn.commit()
+    conn.close()
+
+
+def test_answered_posts_migrate_to_post_state(tmp_path):
+    path = str(tmp_path / "bot.db")
+    legacy_db(
+        path,
+        "CREATE TABLE answered_posts (post_id TEXT PRIMARY KEY, post_nr INTEGER, answered_at TEXT)",
+        "INSERT INTO answered_posts VALUES ('p1', 1, '2025-01-01T00:00:00')",
+    )
+
+    conn = db.init_db(path)
+    db.mark_answered(conn, "p2", 2)
+    conn.close()
+    conn = db.init_db(path)
+
+    states = db.load_post_states(conn)
+    assert {post_id: state["status"] for post_id, state in states.items()} == {
+        "p1": db.STATUS_ANSWERED, "p2": db.STATUS_ANSWERED,
+    }
+    assert states["p1"]["updated_at"] == "2025-01-01T00:00:00"
+    assert db.already_answered(conn, "p1")
+    conn.close()
+
+
+def test_load_post_states_filters_by_status(tmp_path):
+    conn = db.init_db(str(tmp_path / "bot.db"))
+    db.save_post_states(conn, [
+        {"post_id": "a", "post_nr": 1, "status": db.STATUS_FAILED, "attempts": 1},
+        {"post_id": "b", "post_nr": 2, "status": db.STATUS_SKIPPED, "attempts": 0},
+    ])
+
+    assert list(db.load_post_states(conn, (db.STATUS_FAILED,))) == ["a"]
+    assert db.already_answered(conn, "b")
+    assert not db.already_answered(conn, "a")
+    conn.close()
+
+
+def test_should_process():
+    later = (NOW + timedelta(minutes=5)).isoformat()
+    earlier = (NOW - timedelta(minutes=5)).isoformat()
+
+    def state(status, attempts=1, next_retry_at=None):
+        return {"status": status, "attempts": attempts, "next_retry_at": next_retry_at}
+
+    assert db.should_process(None, NOW, 3)
+    assert not db.should_process(state(db.STATUS_ANSWERED), NOW, 3)
+    assert not db.should_process(state(db.STATUS_SKIPPED), NOW, 3)
+    assert db.should_process(state(db.STATUS_GENERATING), NOW, 3)
+    assert not db.should_process(state(db.STATUS_FAILED, next_retry_at=later), NOW, 3)
+    assert db.should_process(state(db.STATUS_FAILED, next_retry_at=earlier), NOW, 3)
+    assert not db.should_process(state(db.STATUS_FAILED, attempts=3, next_retry_at=earlier), NOW, 3)
+
+
+def test_post_state_without_a_draft_column_is_migrated(tmp_path):
+    path = str(tmp_path / "bot.db")
+    legacy_db(
+        path,
+        "CREATE TABLE post_state (post_id TEXT PRIMARY KEY, post_nr INTEGER, status TEXT NOT NULL, "
+        "attempts INTEGER NOT NULL DEFAULT 0, next_retry_at TEXT, last_error TEXT, updated_at TEXT)",
+        "INSERT INTO post_state (post_id, post_nr, status) VALUES ('p1', 1, 'failed')",
+    )
+
+    conn = db.init_db(path)
+    db.save_post_states(conn, [{"post_id": "p2", "post_nr": 2, "status": db.STATUS_DRAFTED, "draft": "Answer."}])
+
+    states = db.load_post_states(conn)
+    assert states["p1"]["draft"] is None
+    assert states["p2"]["draft"] == "Answer."
+    conn.close()
+
+
+def test_should_batch_leaves_drafted_and_in_flight_posts_alone():
+    expired = (NOW - timedelta(minutes=5)).isoformat()
+
+    for status in (db.STATUS_DRAFTED, db.STATUS_PENDING, db.STATUS_GENERATING, db.STATUS_ANSWERED):
+        assert not db.should_batch({"status": status, "attempts": 0}, NOW, 3)
+    assert db.should_batch(None, NOW, 3)
+    assert db.should_batch({"status": db.STATUS_BATCHED, "attempts": 0, "next_retry_at": expired}, NOW, 3)
+
+
+def test_path_keyed_manifest_migrates_to_the_materials_collection(tmp_path):
+    path = str(tmp_path / "bot.db")
+    legacy_db(
+        path,
+        "CREATE TABLE ingest_manifest (path TEXT PRIMARY KEY, source TEXT, mtime REAL, size INTEGER, "
+        "content_hash TEXT, chunk_count INTEGER, ingested_at TEXT)",
+        "INSERT INTO ingest_manifest VALUES ('/course/notes.pdf', 'notes.pdf', 1.5, 10, 'abc', 3, '2025-01-01')",
+    )
+
+    conn = db.init_db(path)
+
+    manifest = db.get_manifest(conn, db.LEGACY_MANIFEST_COLLECTION)
+    assert manifest["/course/notes.pdf"]["source"] == "notes.pdf"
+    assert manifest["/course/notes.pdf"]["chunk_count"] == 3
+    conn.close()
+
+
+def test_manifest_entries_are_kept_per_collection(tmp_path):
+    conn = db.init_db(str(tmp_path / "bot.db"))
+    db.save_manifest_entry(conn, "course_materials", "/course/a.md", "a.md", 1.0, 5, "h1", 1)
+    db.save_manifest_entry(conn, "lab_handouts", "/course/a.md", "a.md", 1.0, 5, "h1", 2)
+
+    db.delete_manifest_entry(conn, "course_materials", "/course/a.md")
+
+    assert db.get_manifest(conn, "course_materials") == {}
+    assert db.get_manifest(conn, "lab_handouts")["/course/a.md"]["chunk_count"] == 2
+    conn.close()
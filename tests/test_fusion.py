@@ -0,0 +1,65 @@
+# Fusion strategies for ranking results from several collections together
+
+from types import SimpleNamespace
+
+import pytest
+
+from rag import fusion
+
+
+def item(distance):
+    return SimpleNamespace(distance=distance)
+
+
+def ranked(pairs):
+    return [(round(score, 6), it.distance) for score, it in pairs]
+
+
+def test_distance_fusion_ranks_by_similarity_across_collections():
+    lists = {"materials": [item(0.55)], "piazza": [item(0.05), item(0.30)]}
+
+    assert [d for _, d in ranked(fusion.distance_fusion(lists))] == [0.05, 0.30, 0.55]
+
+
+def test_weights_scale_a_collections_scores():
+    lists = {"materials": [item(0.2)], "piazza": [item(0.1)]}
+
+    pairs = fusion.distance_fusion(lists, {"materials": 2.0})
+
+    assert ranked(pairs) == [(1.6, 0.2), (0.9, 0.1)]
+
+
+def test_rrf_uses_ranks_only():
+    lists = {"materials": [item(0.55), item(0.6)], "piazza": [item(0.05)]}
+
+    pairs = fusion.reciprocal_rank_fusion(lists, k=60)
+
+    # The best hit of each collection ties, whatever its distance
+    assert pairs[0][0] == pairs[1][0] == pytest.approx(1 / 61)
+    assert pairs[2] == (pytest.approx(1 / 62), lists["materials"][1])
+
+
+def test_minmax_rescales_each_collection():
+    lists = {"materials": [item(0.1), item(0.3), item(0.5)]}
+
+    assert ranked(fusion.min_max_fusion(lists)) == [(1.0, 0.1), (0.5, 0.3), (0.0, 0.5)]
+
+
+def test_minmax_single_hit_keeps_its_raw_similarity():
+    lists = {"materials": [item(0.1), item(0.2)], "piazza": [item(0.55)]}
+
+    pairs = ranked(fusion.min_max_fusion(lists))
+
+    assert (0.45, 0.55) in pairs
+    assert pairs[0] == (1.0, 0.1)
+
+
+def test_empty_lists_are_ignored():
+    assert fusion.min_max_fusion({"materials": []}) == []
+    assert fusion.reciprocal_rank_fusion({}) == []
+
+
+def test_get_strategy():
+    assert fusion.get_strategy("rrf") is fusion.reciprocal_rank_fusion
+    with pytest.raises(ValueError, match="rrf, minmax, distance"):
+        fusion.get_strategy("borda")
@@ -0,0 +1,86 @@
+# Shared Piazza rate limit and backoff in piazza_client._call
+
+from types import SimpleNamespace
+
+import pytest
+
+import piazza_client
+import rate_limit
+
+
+class FakeBucket:
+    def __init__(self):
+        self.acquired = 0
+        self.pauses = []
+
+    def acquire(self):
+        self.acquired += 1
+
+    def pause(self, seconds):
+        self.pauses.append(seconds)
+
+
+@pytest.fixture
+def bucket(monkeypatch):
+    fake = FakeBucket()
+    monkeypatch.setattr(rate_limit, "get_bucket", lambda backend: fake)
+    monkeypatch.setattr(rate_limit, "get_backoff", lambda backend: rate_limit.Backoff(base=2, maximum=120))
+    return fake
+
+
+def failing(*errors, result="ok"):
+    errors = list(errors)
+
+    def method():
+        if errors:
+            raise errors.pop(0)
+        return result
+    return method
+
+
+class HTTPError(OSError):
+    def __init__(self, status_code):
+        super().__init__(f"HTTP {status_code}")
+        self.response = SimpleNamespace(status_code=status_code)
+
+
+def test_permission_error_is_raised_without_pausing(bucket):
+    with pytest.raises(Exception, match="permission"):
+        piazza_client._call(failing(Exception("You do not have permission to answer")), retries=3)
+
+    assert bucket.acquired == 1
+    assert bucket.pauses == []
+
+
+def test_transient_errors_pause_the_bucket_and_retry(bucket):
+    method = failing(HTTPError(503), ConnectionError("reset"), Exception("Too many requests"))
+
+    assert piazza_client._call(method, retries=3) == "ok"
+    assert bucket.pauses == [2, 4, 8]
+
+
+def test_client_http_error_is_not_retried(bucket):
+    with pytest.raises(HTTPError):
+        piazza_client._call(failing(HTTPError(404)), retries=3)
+
+    assert bucket.pauses == []
+
+
+def test_transient_error_is_raised_once_retries_run_out(bucket):
+    with pytest.raises(HTTPError):
+        piazza_client._call(failing(HTTPError(429), HTTPError(429)), retries=1)
+
+    assert bucket.pauses == [2, 4]
+
+
+def test_modified_after_compares_feed_marker_with_stored_utc_time():
+    item = {"modified": "2024-03-01T12:00:00Z"}
+
+    assert piazza_client.modified_after(item, "2024-03-01T11:59:59.500000")
+    assert not piazza_client.modified_after(item, "2024-03-01T12:00:00.000001")
+
+
+def test_modified_after_without_times_is_false():
+    assert not piazza_client.modified_after({}, "2024-03-01T12:00:00")
+    assert not piazza_client.modified_after({"modified": "2024-03-01T12:00:00Z"}, None)
+    assert not piazza_client.modified_after({"modified": "yesterday"}, "2024-03-01T12:00:00")
@@ -0,0 +1,74 @@
+# Staged worker pools in pipeline.py
+
+import threading
+import time
+
+import pytest
+
+from pipeline import Pipeline, Stage
+
+
+def test_items_pass_through_every_stage():
+    pipeline = Pipeline([
+        Stage("double", lambda x: x * 2, workers=3),
+        Stage("increment", lambda x: x + 1, workers=2),
+    ], queue_size=2)
+
+    assert sorted(pipeline.run(range(20))) == [2 * x + 1 for x in range(20)]
+
+
+def test_none_drops_an_item_and_errors_do_not_stop_the_pipeline():
+    def check(x):
+        if x == 3:
+            raise RuntimeError("bad item")
+        return x if x % 2 else None
+
+    assert sorted(Pipeline([Stage("check", check, workers=2)]).run(range(8))) == [1, 5, 7]
+
+
+def test_batching_stage_receives_lists():
+    seen = []
+
+    def batch(items):
+        seen.append(len(items))
+        return [None if item == 0 else item for item in items]
+
+    results = Pipeline([Stage("slow", lambda x: x), Stage("batch", batch, batch_size=4)]).run(range(10))
+
+    assert sorted(results) == list(range(1, 10))
+    assert sum(seen) == 10
+    assert max(seen) <= 4
+
+
+def test_stages_run_concurrently():
+    running = 0
+    peak = 0
+    lock = threading.Lock()
+
+    def work(x):
+        nonlocal running, peak
+        with lock:
+            running += 1
+            peak = max(peak, running)
+        time.sleep(0.02)
+        with lock:
+            running -= 1
+        return x
+
+    Pipeline([Stage("work", work, workers=4)]).run(range(8))
+
+    assert peak > 1
+
+
+def test_a_failing_generator_still_releases_the_workers():
+    def items():
+        yield 1
+        raise KeyboardInterrupt
+
+    with pytest.raises(KeyboardInterrupt):
+        Pipeline([Stage("noop", lambda x: x, workers=2)]).run(items())
+
+    workers = [t for t in threading.enumerate() if t.name.startswith("noop-")]
+    for thread in workers:
+        thread.join(timeout=2)
+    assert not any(thread.is_alive() for thread in workers)
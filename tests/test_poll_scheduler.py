@@ -0,0 +1,54 @@
+# Adaptive poll interval
+
+from datetime import datetime
+
+from poll_scheduler import PollScheduler
+
+NOON = datetime(2026, 3, 2, 12, 0)
+
+
+def scheduler(**kwargs):
+    return PollScheduler(initial_interval=60, min_interval=15, max_interval=300, **kwargs)
+
+
+def test_activity_shrinks_the_interval_down_to_the_minimum():
+    poll = scheduler()
+
+    assert [poll.next_interval(3, NOON) for _ in range(4)] == [30, 15, 15, 15]
+
+
+def test_quiet_cycles_grow_the_interval_up_to_the_maximum():
+    poll = scheduler()
+
+    intervals = [poll.next_interval(0, NOON) for _ in range(6)]
+
+    assert intervals[:2] == [90, 135]
+    assert intervals[-1] == 300
+
+
+def test_initial_interval_is_clamped():
+    assert PollScheduler(initial_interval=1, min_interval=15, max_interval=300).interval == 15
+
+
+def test_quiet_hours_may_wrap_past_midnight():
+    poll = scheduler(quiet_hours=(22, 6), quiet_interval=900)
+
+    assert poll.in_quiet_hours(datetime(2026, 3, 2, 23, 30))
+    assert poll.in_quiet_hours(datetime(2026, 3, 2, 5, 59))
+    assert not poll.in_quiet_hours(datetime(2026, 3, 2, 6, 0))
+    assert not poll.in_quiet_hours(NOON)
+
+
+def test_quiet_hours_set_a_floor_without_changing_the_adapted_interval():
+    poll = scheduler(quiet_hours=(2, 7), quiet_interval=900)
+
+    assert poll.next_interval(1, datetime(2026, 3, 2, 3, 0)) == 900
+    assert poll.interval == 30
+    assert poll.next_interval(1, NOON) == 15
+
+
+def test_no_quiet_hours_by_default():
+    poll = scheduler(quiet_interval=900)
+
+    assert not poll.in_quiet_hours(datetime(2026, 3, 2, 3, 0))
+    assert poll.next_interval(1, datetime(2026, 3, 2, 3, 0)) == 30
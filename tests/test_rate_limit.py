@@ -0,0 +1,111 @@
+# Token buckets, backoff and rate-limit header parsing
+
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import rate_limit
+from rate_limit import Backoff, TokenBucket
+
+
+class Clock:
+    """Fake monotonic clock; sleeping advances it."""
+
+    def __init__(self):
+        self.now = 100.0
+        self.slept = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(rate_limit.time, "monotonic", clock.monotonic)
+    monkeypatch.setattr(rate_limit.time, "sleep", clock.sleep)
+    return clock
+
+
+def test_bucket_allows_a_burst_then_paces_callers(clock):
+    bucket = TokenBucket(rate=2.0, capacity=2)
+
+    for _ in range(4):
+        bucket.acquire()
+
+    assert clock.slept == [pytest.approx(0.5), pytest.approx(0.5)]
+
+
+def test_bucket_refills_while_idle(clock):
+    bucket = TokenBucket(rate=1.0, capacity=3)
+    for _ in range(3):
+        bucket.acquire()
+
+    clock.now += 10
+    for _ in range(3):
+        bucket.acquire()
+
+    assert clock.slept == []
+
+
+def test_pause_holds_back_every_caller(clock):
+    bucket = TokenBucket(rate=100.0, capacity=5)
+
+    bucket.pause(3)
+    bucket.pause(1)
+    bucket.acquire()
+
+    assert clock.slept == [pytest.approx(3)]
+
+
+def test_set_rate_ignores_non_positive_rates():
+    bucket = TokenBucket(rate=2.0)
+
+    bucket.set_rate(0)
+    assert bucket.rate == 2.0
+    bucket.set_rate(0.5)
+    assert bucket.rate == 0.5
+
+
+def test_backoff_doubles_up_to_the_maximum_and_resets():
+    backoff = Backoff(base=1, maximum=5)
+
+    assert [backoff.failure() for _ in range(4)] == [1, 2, 4, 5]
+    backoff.success()
+    assert backoff.failure() == 1
+
+
+def test_registry_returns_one_bucket_per_backend():
+    assert rate_limit.get_bucket("piazza") is rate_limit.get_bucket("piazza")
+    assert rate_limit.get_bucket("piazza") is not rate_limit.get_bucket("anthropic")
+    assert rate_limit.get_backoff("anthropic") is rate_limit.get_backoff("anthropic")
+
+
+def test_retry_after_header_wins():
+    assert rate_limit.retry_delay_from_headers({"retry-after": "7"}) == 7.0
+    assert rate_limit.retry_delay_from_headers({"retry-after": "soon"}) is None
+    assert rate_limit.retry_delay_from_headers(None) is None
+
+
+def test_exhausted_counter_waits_for_its_reset():
+    reset = (datetime.now(timezone.utc) + timedelta(seconds=30)).isoformat().replace("+00:00", "Z")
+    headers = {
+        "anthropic-ratelimit-requests-remaining": "0",
+        "anthropic-ratelimit-requests-reset": reset,
+        "anthropic-ratelimit-tokens-remaining": "5000",
+        "anthropic-ratelimit-tokens-reset": reset,
+    }
+
+    assert rate_limit.retry_delay_from_headers(headers) == pytest.approx(30, abs=2)
+    headers["anthropic-ratelimit-requests-remaining"] = "3"
+    assert rate_limit.retry_delay_from_headers(headers) is None
+
+
+def test_requests_per_second_from_headers():
+    assert rate_limit.requests_per_second_from_headers({"anthropic-ratelimit-requests-limit": "120"}) == 2.0
+    assert rate_limit.requests_per_second_from_headers({"anthropic-ratelimit-requests-limit": "many"}) is None
+    assert rate_limit.requests_per_second_from_headers({}) is None
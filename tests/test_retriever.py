@@ -0,0 +1,134 @@
+# Context assembly in rag.retriever, without a vector store
+
+from types import SimpleNamespace
+
+import pytest
+
+from rag import retriever as retriever_module
+from rag import vector_store
+
+
+@pytest.fixture(autouse=True)
+def no_store(monkeypatch):
+    monkeypatch.setattr(vector_store, "init_store", lambda path: None)
+    monkeypatch.setattr(
+        vector_store, "get_or_create_collection", lambda client, name, model: SimpleNamespace(name=name)
+    )
+
+
+def make_retriever(**kwargs):
+    kwargs.setdefault("collections", {"course_materials": {"kind": "materials"}, "piazza_history": {"kind": "piazza"}})
+    return retriever_module.Retriever("./unused", "model", **kwargs)
+
+
+def material(chunk_id, text, distance, source="notes.pdf", chunk_index=0):
+    return {"id": chunk_id, "text": text, "distance": distance,
+            "metadata": {"source": source, "chunk_index": chunk_index}}
+
+
+def qa(post_id, text, distance, post_nr=7):
+    return {"id": post_id, "text": text, "distance": distance, "metadata": {"post_nr": post_nr}}
+
+
+def test_no_collections_is_rejected():
+    with pytest.raises(ValueError, match="RAG_COLLECTIONS"):
+        make_retriever(collections={})
+
+
+def test_default_fusion_orders_context_by_distance_across_collections():
+    retriever = make_retriever()
+
+    result = retriever.build_context({
+        "course_materials": [material("m1", "far material", 0.55)],
+        "piazza_history": [qa("p1", "close answer", 0.05)],
+    })
+
+    assert [item.ids for item in result.items] == [["p1"], ["m1"]]
+    assert result.text.index("close answer") < result.text.index("far material")
+    assert result.distances == [0.05, 0.55]
+
+
+def test_collection_weight_changes_the_order():
+    retriever = make_retriever(collections={
+        "course_materials": {"kind": "materials", "weight": 3.0},
+        "piazza_history": {"kind": "piazza"},
+    })
+
+    result = retriever.build_context({
+        "course_materials": [material("m1", "weighted material", 0.5)],
+        "piazza_history": [qa("p1", "answer", 0.05)],
+    })
+
+    assert [item.ids for item in result.items] == [["m1"], ["p1"]]
+
+
+def test_a_failing_collection_contributes_no_results(monkeypatch):
+    retriever = make_retriever()
+
+    def query(collection, embeddings, top_k):
+        if collection.name == "piazza_history":
+            raise RuntimeError("collection unavailable")
+        return [[material("m1", "text", 0.1)] for _ in embeddings]
+    monkeypatch.setattr(vector_store, "query_collection_many", query)
+
+    [hits] = retriever.search_many(["question"], embeddings=[[0.1, 0.2]])
+
+    assert hits["piazza_history"] == []
+    assert [r["id"] for r in hits["course_materials"]] == ["m1"]
+    assert hits["course_materials"][0]["kind"] == "materials"
+
+
+def test_adjacent_chunks_merge_without_repeating_the_overlap():
+    items = retriever_module._merge_adjacent_chunks("course_materials", [
+        material("c2", "three four five six", 0.3, chunk_index=1),
+        material("c1", "one two three four", 0.2, chunk_index=0),
+        material("c4", "far away chunk", 0.1, chunk_index=3),
+        material("o1", "other file", 0.4, source="other.md", chunk_index=1),
+    ])
+
+    by_ids = {tuple(item.ids): item for item in items}
+    assert set(by_ids) == {("c1", "c2"), ("c4",), ("o1",)}
+    merged = by_ids[("c1", "c2")]
+    assert merged.text == "one two three four five six"
+    assert merged.distance == 0.2
+    assert merged.label == "[From course materials - notes.pdf]"
+    assert by_ids[("o1",)].label == "[From course materials - other.md]"
+
+
+def test_chunks_without_an_index_are_kept_apart():
+    items = retriever_module._merge_adjacent_chunks("course_materials", [
+        {"id": "a", "text": "first", "distance": 0.1, "metadata": {"source": "notes.pdf"}},
+        {"id": "b", "text": "second", "distance": 0.2, "metadata": {"source": "notes.pdf"}},
+    ])
+
+    assert [item.ids for item in items] == [["a"], ["b"]]
+
+
+def test_build_context_counts_merged_and_far_results():
+    retriever = make_retriever(max_distance=0.5)
+
+    result = retriever.build_context({
+        "course_materials": [
+            material("c1", "alpha beta", 0.2, chunk_index=0),
+            material("c2", "beta gamma", 0.3, chunk_index=1),
+            material("c9", "too far", 0.9, chunk_index=8),
+        ],
+        "piazza_history": [],
+    })
+
+    assert [item.ids for item in result.items] == [["c1", "c2"]]
+    assert result.items[0].text == "alpha beta gamma"
+    assert (result.merged, result.dropped_far) == (1, 1)
+
+
+def test_token_budget_drops_what_does_not_fit_and_trims_an_oversized_best_item():
+    retriever = make_retriever(token_budget=30)
+
+    result = retriever.build_context({
+        "course_materials": [material("m1", "word " * 100, 0.1)],
+        "piazza_history": [qa("p1", "short answer", 0.2)],
+    })
+
+    assert [item.ids for item in result.items] == [["m1"]]
+    assert len(result.items[0].text.split()) == (30 * 3) // 4
+    assert result.dropped_budget == 1
@@ -0,0 +1,101 @@
+# Model routing: the local heuristic and the router-model fallback
+
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+import ai_answerer
+import config
+import metrics
+import rate_limit
+from rag.classifier import Classification
+
+
+class FakeRawMessages:
+    def __init__(self, reply=None, error=None):
+        self.reply = reply
+        self.error = error
+        self.calls = []
+
+    async def create(self, **request):
+        self.calls.append(request)
+        if self.error:
+            raise self.error
+        message = SimpleNamespace(
+            content=[SimpleNamespace(text=self.reply)],
+            usage=SimpleNamespace(input_tokens=40, output_tokens=2),
+        )
+        return SimpleNamespace(headers={}, parse=lambda: message)
+
+
+class FakeBucket:
+    def __init__(self):
+        self.pauses = []
+
+    async def acquire_async(self):
+        pass
+
+    def pause(self, seconds):
+        self.pauses.append(seconds)
+
+    def set_rate(self, rate):
+        pass
+
+
+@pytest.fixture
+def router(monkeypatch):
+    def install(reply=None, error=None):
+        raw = FakeRawMessages(reply, error)
+        client = SimpleNamespace(messages=SimpleNamespace(with_raw_response=raw))
+        monkeypatch.setattr(ai_answerer, "get_async_client", lambda api_key: client)
+        return raw
+    bucket = FakeBucket()
+    monkeypatch.setattr(rate_limit, "get_bucket", lambda backend: bucket)
+    monkeypatch.setattr(rate_limit, "get_backoff", lambda backend: rate_limit.Backoff(base=2, maximum=120))
+    monkeypatch.setattr(metrics, "_counters", {})
+    monkeypatch.setattr(config, "ROUTE_LLM_FALLBACK", True)
+    install.bucket = bucket
+    return install
+
+
+def classification(category="conceptual", confidence=0.3, covered=False, long=False):
+    return Classification(category=category, confidence=confidence, covered=covered, long=long)
+
+
+def test_route_label_from_the_heuristic():
+    assert ai_answerer.route_label(classification("logistics")) == "logistics"
+    assert ai_answerer.route_label(classification(covered=True)) == "simple"
+    assert ai_answerer.route_label(classification(covered=True, long=True)) == "complex"
+    assert ai_answerer.route_label(classification(confidence=0.0)) is None
+
+
+def test_confident_heuristic_skips_the_router_model(router):
+    raw = router(reply="simple")
+
+    route = asyncio.run(ai_answerer.aroute("s", "q", "key", classification("logistics")))
+
+    assert route == "logistics"
+    assert raw.calls == []
+
+
+def test_router_model_decides_ambiguous_questions_and_its_tokens_are_counted(router):
+    router(reply="Simple.")
+
+    route = asyncio.run(ai_answerer.aroute("s", "q", "key", classification(confidence=0.0)))
+
+    assert route == "simple"
+    assert metrics.get("anthropic.input_tokens") == 40
+    assert metrics.get("routes.router_output_tokens") == 2
+
+
+def test_rate_limited_router_pauses_the_bucket_and_uses_the_default_route(router):
+    # Built without __init__, which needs a real HTTP response
+    error = ai_answerer.RateLimitError.__new__(ai_answerer.RateLimitError)
+    error.response = SimpleNamespace(headers={"retry-after": "7"})
+    router(error=error)
+
+    route = asyncio.run(ai_answerer.aroute("s", "q", "key", classification(confidence=0.0)))
+
+    assert route == config.ROUTE_DEFAULT
+    assert router.bucket.pauses == [7.0]
@@ -0,0 +1,48 @@
+# Embedding model bookkeeping in rag.vector_store
+
+from types import SimpleNamespace
+
+import pytest
+
+from rag import vector_store
+
+
+class FakeClient:
+    """Mimics Chroma versions whose get_or_create_collection applies the given metadata to an existing collection."""
+
+    def __init__(self):
+        self.collections = {}
+
+    def get_collection(self, name):
+        if name not in self.collections:
+            raise ValueError(f"Collection {name} does not exist.")
+        return self.collections[name]
+
+    def get_or_create_collection(self, name, metadata=None):
+        collection = self.collections.setdefault(name, SimpleNamespace(name=name, metadata={}))
+        collection.metadata = metadata
+        return collection
+
+
+def test_new_collection_records_its_model():
+    client = FakeClient()
+
+    collection = vector_store.get_or_create_collection(client, "course_materials", "model-a")
+
+    assert collection.metadata == {"hnsw:space": "cosine", "embedding_model": "model-a"}
+
+
+def test_existing_collection_with_same_model_is_reused():
+    client = FakeClient()
+    created = vector_store.get_or_create_collection(client, "course_materials", "model-a")
+
+    assert vector_store.get_or_create_collection(client, "course_materials", "model-a") is created
+
+
+def test_model_mismatch_is_rejected_without_overwriting_the_record():
+    client = FakeClient()
+    vector_store.get_or_create_collection(client, "course_materials", "model-a")
+
+    with pytest.raises(ValueError, match="model-a"):
+        vector_store.get_or_create_collection(client, "course_materials", "model-b")
+    assert client.collections["course_materials"].metadata["embedding_model"] == "model-a"